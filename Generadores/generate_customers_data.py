@@ -1,18 +1,49 @@
-import boto3
 from faker import Faker
 import random
 import json
-import csv
-import io
+from itertools import chain
 from datetime import datetime
-
-# Configuración de S3
+import os
+import sys
+import uuid
+
+# Módulos compartidos en la raíz del repositorio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from settings import dataset_options
+from storage import create_storage, ObjectNotFound
+from streaming_upload import upload_records
+from clustering import cluster, stats_columns
+from spool import spool_directory, publish, drain, max_attempts
+from key_sharding import sharded_run_key
+from rollover import RolloverPolicy, generate_records, serialized_size
+from compression import compressed_key
+from json_stream import open_json_array
+
+# Almacenamiento (STORAGE_BACKEND: "s3", "local" o "memory")
 bucket_name = "data-lake-simulacion"
-s3_client = boto3.client('s3')
+storage = create_storage(bucket_name)
+
+# Formato de salida por dataset (p. ej. OUTPUT_FORMATS="customers=parquet")
+dataset_formats = dataset_options("OUTPUT_FORMATS", {"customers": "json", "transactions": "csv"})
+
+# Compresión por dataset: "none", "gzip" o "zstd" (p. ej. OUTPUT_COMPRESSION="customers=zstd")
+dataset_compression = dataset_options("OUTPUT_COMPRESSION", {"customers": "none", "transactions": "none"})
+
+# Con KEY_SHARDS cada ejecución escribe bajo un prefijo hash propio
+run_id = uuid.uuid4().hex
+
+# Spool local durable opcional (SPOOL_DIR) entre la generación y la subida
+spool = spool_directory("customers")
 
 # Ruta del archivo en S3
-customers_file = "data/json/customers.json"
-transactions_file = "data/csv/transactions.csv"
+customers_file = sharded_run_key(compressed_key(
+    "data/parquet/customers.parquet" if dataset_formats["customers"] == "parquet" else "data/json/customers.json",
+    dataset_compression["customers"],
+), run_id)
+transactions_file = sharded_run_key(compressed_key(
+    "data/parquet/transactions.parquet" if dataset_formats["transactions"] == "parquet" else "data/csv/transactions.csv",
+    dataset_compression["transactions"],
+), run_id)
 
 # Inicializar Faker
 fake = Faker()
@@ -24,6 +55,10 @@ with open("product_names.json", "r") as f:
 # Lista para almacenar transacciones compartidas
 shared_transactions = []
 
+# Tamaño del lote: sin TARGET_OBJECT_MB/TARGET_OBJECT_ROWS se generan 200 registros;
+# con objetivo, se mide lo generado en el formato en que se escribe y se completa hasta el objetivo
+customers_policy = RolloverPolicy(initial_batch_size=200)
+
 def generate_customer_data():
     """Genera un cliente único con una transacción que incluye múltiples productos."""
     customer_id = str(fake.uuid4())
@@ -72,53 +107,75 @@ def generate_customer_data():
 
     return customer_data
 
-def upload_to_s3(data, filename, format_type="json"):
+def upload_to_s3(data, filename, format_type="json", schema=None, compression=None):
     """Sube datos a S3 en el formato especificado."""
     if format_type == "json":
         try:
+            # Los registros existentes se leen en streaming mientras se sube el archivo nuevo
             existing_data = []
             try:
-                response = s3_client.get_object(Bucket=bucket_name, Key=filename)
-                existing_data = json.loads(response["Body"].read().decode("utf-8"))
-            except s3_client.exceptions.NoSuchKey:
+                existing_data = open_json_array(storage, filename)
+            except ObjectNotFound:
                 pass  # Si no existe, empieza con una lista vacía
 
-            combined_data = existing_data + data
-            s3_client.put_object(Bucket=bucket_name, Key=filename, Body=json.dumps(combined_data, indent=4))
+            upload_records(storage, filename, chain(existing_data, data), "json", compression=compression, stats_columns=stats_columns(schema))
             print(f"Datos subidos a S3: {filename}")
+            return True
         except Exception as e:
             print(f"Error al subir {filename} a S3: {e}")
+            return False
     elif format_type == "csv":
-        output = io.StringIO()
         fieldnames = ["transaction_id", "customer_id", "transaction_date", "product_name", "category", "amount", "total_amount"]
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-
-        writer.writeheader()
-        for transaction in data:
-            for product in transaction["products"]:
-                writer.writerow({
-                    "transaction_id": transaction["transaction_id"],
-                    "customer_id": transaction["customer_id"],
-                    "transaction_date": transaction["transaction_date"],
-                    "product_name": product["product_name"],
-                    "category": product["category"],
-                    "amount": product["amount"],
-                    "total_amount": transaction["total_amount"]
-                })
+
+        # Una fila por producto, generada a medida que se sube
+        rows = (
+            {
+                "transaction_id": transaction["transaction_id"],
+                "customer_id": transaction["customer_id"],
+                "transaction_date": transaction["transaction_date"],
+                "product_name": product["product_name"],
+                "category": product["category"],
+                "amount": product["amount"],
+                "total_amount": transaction["total_amount"]
+            }
+            for transaction in data
+            for product in transaction["products"]
+        )
 
         try:
-            s3_client.put_object(Bucket=bucket_name, Key=filename, Body=output.getvalue())
+            upload_records(storage, filename, rows, "csv", fieldnames=fieldnames, compression=compression, stats_columns=stats_columns(schema))
             print(f"Datos subidos a S3: {filename}")
+            return True
         except Exception as e:
             print(f"Error al subir {filename} a S3: {e}")
+            return False
+    elif format_type == "parquet":
+        try:
+            upload_records(storage, filename, data, "parquet", schema, compression=compression, stats_columns=stats_columns(schema))
+            print(f"Datos subidos a S3: {filename}")
+            return True
+        except Exception as e:
+            print(f"Error al subir {filename} a S3: {e}")
+            return False
 
 def main():
     print("Generando datos de clientes y transacciones...")
-    customers = [generate_customer_data() for _ in range(200)]
+    customers = generate_records(
+        generate_customer_data, customers_policy, "customers",
+        serialized_size(dataset_formats["customers"], "customers_single_transaction", dataset_compression["customers"]),
+    )
+
+    # Con CLUSTER_BATCHES los lotes se ordenan por sus columnas de clustering
+    customers = cluster(customers, "customers_single_transaction")
+    transactions = cluster(shared_transactions, "transactions_products")
 
     # Subir datos a S3
-    upload_to_s3(customers, customers_file, "json")
-    upload_to_s3(shared_transactions, transactions_file, "csv")
+    publish(spool, upload_to_s3, customers, filename=customers_file, format_type=dataset_formats["customers"], schema="customers_single_transaction", compression=dataset_compression["customers"])
+    publish(spool, upload_to_s3, transactions, filename=transactions_file, format_type=dataset_formats["transactions"], schema="transactions_products", compression=dataset_compression["transactions"])
+
+    # Subir los segmentos del spool (incluidos los pendientes de ejecuciones anteriores)
+    if spool is not None:
+        drain(spool, upload_to_s3, max_attempts=max_attempts or 5)
 
     print("Datos de clientes y transacciones generados y subidos correctamente.")
 
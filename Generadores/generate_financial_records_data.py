@@ -1,16 +1,43 @@
-import boto3
 import random
 import json
 from datetime import datetime, timedelta
 from faker import Faker
 import time
+import os
+import sys
+import uuid
 
-# Configuración de S3
+# Módulos compartidos en la raíz del repositorio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from settings import dataset_options
+from storage import create_storage
+from streaming_upload import upload_records
+from clustering import cluster, stats_columns
+from spool import spool_directory, publish, drain, max_attempts
+from key_sharding import sharded_run_key
+from compression import compressed_key
+
+# Almacenamiento (STORAGE_BACKEND: "s3", "local" o "memory")
 bucket_name = "data-lake-simulacion"  # Nombre del bucket S3
-s3_client = boto3.client('s3')
+storage = create_storage(bucket_name)
+
+# Formato de salida por dataset (p. ej. OUTPUT_FORMATS="receipts=parquet")
+dataset_formats = dataset_options("OUTPUT_FORMATS", {"receipts": "json"})
+
+# Compresión por dataset: "none", "gzip" o "zstd" (p. ej. OUTPUT_COMPRESSION="receipts=gzip")
+dataset_compression = dataset_options("OUTPUT_COMPRESSION", {"receipts": "none"})
+
+# Con KEY_SHARDS cada ejecución escribe bajo un prefijo hash propio
+run_id = uuid.uuid4().hex
+
+# Spool local durable opcional (SPOOL_DIR) entre la generación y la subida
+spool = spool_directory("financial_records")
 
 # Nombre del archivo en S3
-receipts_file = "data/json/receipts.json"
+receipts_file = sharded_run_key(compressed_key(
+    "data/parquet/receipts.parquet" if dataset_formats["receipts"] == "parquet" else "data/json/receipts.json",
+    dataset_compression["receipts"],
+), run_id)
 
 # Inicializar Faker
 fake = Faker()
@@ -34,14 +61,15 @@ def generate_receipt_data(transaction_data):
         receipts.append(receipt)
     return receipts
 
-def upload_to_s3(data, filename):
-    """Sube datos a S3 en formato JSON."""
-    json_data = json.dumps(data, indent=4)
+def upload_to_s3(data, filename, format_type="json", compression=None):
+    """Sube datos a S3 en formato JSON o Parquet."""
     try:
-        s3_client.put_object(Bucket=bucket_name, Key=filename, Body=json_data)
+        upload_records(storage, filename, data, format_type, "receipts", compression=compression, stats_columns=stats_columns("receipts"))
         print(f"Datos subidos a S3: {filename}")
+        return True
     except Exception as e:
         print(f"Error al subir {filename} a S3: {e}")
+        return False
 
 def main():
     print("Generando datos de recibos...")
@@ -50,10 +78,14 @@ def main():
     with open("transactions.json", "r") as f:  # Asegúrate de tener un archivo de transacciones local para la prueba
         transaction_data = json.load(f)
 
-    receipts = generate_receipt_data(transaction_data)
+    receipts = cluster(generate_receipt_data(transaction_data), "receipts")
 
     # Subir recibos a S3
-    upload_to_s3(receipts, receipts_file)
+    publish(spool, upload_to_s3, receipts, filename=receipts_file, format_type=dataset_formats["receipts"], compression=dataset_compression["receipts"])
+
+    # Subir los segmentos del spool (incluidos los pendientes de ejecuciones anteriores)
+    if spool is not None:
+        drain(spool, upload_to_s3, max_attempts=max_attempts or 5)
     print("Datos de recibos generados y subidos a S3 correctamente.")
 
 if __name__ == "__main__":
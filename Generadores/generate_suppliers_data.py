@@ -1,15 +1,46 @@
-import boto3
 import json
 import random
 from faker import Faker
-
-# Configuración de S3
+import os
+import sys
+import uuid
+
+# Módulos compartidos en la raíz del repositorio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from settings import dataset_options
+from storage import create_storage
+from streaming_upload import upload_records
+from clustering import cluster, stats_columns
+from spool import spool_directory, publish, drain, max_attempts
+from key_sharding import sharded_run_key
+from rollover import RolloverPolicy, generate_records, serialized_size
+from compression import compressed_key
+
+# Almacenamiento (STORAGE_BACKEND: "s3", "local" o "memory")
 bucket_name = "data-lake-simulacion"  # Nombre del bucket S3
-s3_client = boto3.client('s3')
+storage = create_storage(bucket_name)
+
+# Formato de salida por dataset (p. ej. OUTPUT_FORMATS="inventories=parquet")
+dataset_formats = dataset_options("OUTPUT_FORMATS", {"inventories": "json", "transactions": "json"})
+
+# Compresión por dataset: "none", "gzip" o "zstd" (p. ej. OUTPUT_COMPRESSION="inventories=zstd")
+dataset_compression = dataset_options("OUTPUT_COMPRESSION", {"inventories": "none", "transactions": "none"})
+
+# Con KEY_SHARDS cada ejecución escribe bajo un prefijo hash propio
+run_id = uuid.uuid4().hex
+
+# Spool local durable opcional (SPOOL_DIR) entre la generación y la subida
+spool = spool_directory("suppliers")
 
 # Nombre del archivo en S3
-inventory_file = "data/json/inventories.json"
-transactions_file = "data/json/transactions.json"
+inventory_file = sharded_run_key(compressed_key(
+    "data/parquet/inventories.parquet" if dataset_formats["inventories"] == "parquet" else "data/json/inventories.json",
+    dataset_compression["inventories"],
+), run_id)
+transactions_file = sharded_run_key(compressed_key(
+    "data/parquet/inventory_transactions.parquet" if dataset_formats["transactions"] == "parquet" else "data/json/transactions.json",
+    dataset_compression["transactions"],
+), run_id)
 
 # Inicializar Faker
 fake = Faker()
@@ -20,6 +51,10 @@ with open("product_names.json", "r") as f:
 
 categories = list(product_names.keys())
 
+# Tamaño del lote: sin TARGET_OBJECT_MB/TARGET_OBJECT_ROWS se generan 300 registros;
+# con objetivo, se mide lo generado en el formato en que se escribe y se completa hasta el objetivo
+inventory_policy = RolloverPolicy(initial_batch_size=300)
+
 def generate_inventory_data():
     """Genera un registro único de inventario."""
     warehouse_id = fake.uuid4()
@@ -60,33 +95,38 @@ def generate_associated_data(inventories):
             })
     return transactions
 
-def upload_to_s3(data, filename):
-    """Sube datos a S3 en formato JSON."""
-    # Convertir los datos a JSON
-    json_data = json.dumps(data, indent=4)
-
-    # Subir a S3
+def upload_to_s3(data, filename, format_type="json", schema=None, compression=None):
+    """Sube datos a S3 en formato JSON o Parquet."""
     try:
-        s3_client.put_object(Bucket=bucket_name, Key=filename, Body=json_data)
+        upload_records(storage, filename, data, format_type, schema, compression=compression, stats_columns=stats_columns(schema))
         print(f"Datos subidos a S3: {filename}")
+        return True
     except Exception as e:
         print(f"Error al subir {filename} a S3: {e}")
+        return False
 
 def main():
     print("Generando datos de inventarios y datos asociados...")
-    inventories = []
-
-    # Generar 300 registros de inventario
-    for _ in range(300):
-        inventory_data = generate_inventory_data()
-        inventories.append(inventory_data)
+    # Generar registros de inventario (300 por defecto)
+    inventories = generate_records(
+        generate_inventory_data, inventory_policy, "inventories",
+        serialized_size(dataset_formats["inventories"], "inventories", dataset_compression["inventories"]),
+    )
 
     # Generar datos asociados (transacciones basadas en inventarios)
     transactions = generate_associated_data(inventories)
 
+    # Con CLUSTER_BATCHES los lotes se ordenan por sus columnas de clustering
+    inventories = cluster(inventories, "inventories")
+    transactions = cluster(transactions, "inventory_transactions")
+
     # Subir datos a S3 en formato JSON
-    upload_to_s3(inventories, inventory_file)
-    upload_to_s3(transactions, transactions_file)
+    publish(spool, upload_to_s3, inventories, filename=inventory_file, format_type=dataset_formats["inventories"], schema="inventories", compression=dataset_compression["inventories"])
+    publish(spool, upload_to_s3, transactions, filename=transactions_file, format_type=dataset_formats["transactions"], schema="inventory_transactions", compression=dataset_compression["transactions"])
+
+    # Subir los segmentos del spool (incluidos los pendientes de ejecuciones anteriores)
+    if spool is not None:
+        drain(spool, upload_to_s3, max_attempts=max_attempts or 5)
     print("Datos de inventarios y transacciones generados y subidos a S3 correctamente.")
 
 if __name__ == "__main__":
@@ -1,15 +1,48 @@
-import boto3
-import csv
-import io
 from faker import Faker
 import random
 import json
 from datetime import datetime
-
-# Configuración de S3
+import os
+import sys
+import uuid
+
+# Módulos compartidos en la raíz del repositorio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from settings import dataset_options
+from storage import create_storage
+from object_cache import ObjectCache
+from json_stream import iter_json_stream
+from streaming_upload import upload_records
+from clustering import cluster, stats_columns
+from spool import spool_directory, publish, drain, max_attempts
+from key_sharding import shard_count, sharded_run_key, list_shard_keys
+from compression import compressed_key, detect_compression
+
+# Almacenamiento (STORAGE_BACKEND: "s3", "local" o "memory")
 bucket_name = "data-lake-simulacion"  # Nombre del bucket S3
-s3_client = boto3.client('s3')
-transactions_file = "data/csv/transactions.csv"  # Ruta actualizada para transacciones
+storage = create_storage(bucket_name)
+
+# Caché de los objetos leídos ya parseados (OBJECT_CACHE_MB, OBJECT_CACHE_DIR):
+# en un Lambda caliente los clientes sin cambios no se vuelven a descargar
+object_cache = ObjectCache(bucket_name)
+
+# Formato de salida por dataset (p. ej. OUTPUT_FORMATS="transactions=parquet")
+dataset_formats = dataset_options("OUTPUT_FORMATS", {"transactions": "csv"})
+
+# Compresión por dataset: "none", "gzip" o "zstd"; "customers" indica cómo se escribió
+# el archivo de clientes que se lee (p. ej. OUTPUT_COMPRESSION="customers=zstd")
+dataset_compression = dataset_options("OUTPUT_COMPRESSION", {"customers": "none", "transactions": "none"})
+
+# Con KEY_SHARDS cada ejecución escribe bajo un prefijo hash propio
+run_id = uuid.uuid4().hex
+
+# Spool local durable opcional (SPOOL_DIR) entre la generación y la subida
+spool = spool_directory("transactions")
+
+if dataset_formats["transactions"] == "parquet":
+    transactions_file = sharded_run_key("data/parquet/transactions.parquet", run_id)
+else:
+    transactions_file = sharded_run_key(compressed_key("data/csv/transactions.csv", dataset_compression["transactions"]), run_id)  # Ruta actualizada para transacciones
 
 # Inicializar Faker
 fake = Faker()
@@ -18,49 +51,50 @@ fake = Faker()
 with open("product_names.json", "r") as f:
     product_names = json.load(f)
 
-# Leer datos existentes desde S3
-def read_existing_data(filename):
-    """Lee datos existentes desde S3 y retorna una lista de diccionarios."""
-    try:
-        response = s3_client.get_object(Bucket=bucket_name, Key=filename)
-        content = response["Body"].read().decode("utf-8")
-        reader = csv.DictReader(io.StringIO(content))
-        return list(reader)
-    except s3_client.exceptions.NoSuchKey:
-        # Si no existe el archivo, retornar una lista vacía
-        return []
-    except Exception as e:
-        print(f"Error al leer {filename}: {e}")
-        return []
+# Leer clientes desde S3
+def iter_customers(customers_files):
+    """Clientes de los archivos, leídos en streaming (y a través de la caché) a medida que se consumen."""
+    for customers_file in customers_files:
+        yield from object_cache.stream(storage, customers_file, iter_json_stream, detect_compression(customers_file))
 
 # Subir transacciones a S3 en formato CSV
-def upload_transactions_to_s3(transactions, filename):
-    """Sube las transacciones a S3 en formato CSV, desglosando los productos."""
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # Encabezados: una fila por producto dentro de una transacción
-    writer.writerow(["transaction_id", "customer_id", "transaction_date", "product_name", "category", "amount", "total_amount"])
-
-    # Escribir datos
-    for transaction in transactions:
-        for product in transaction["products"]:
-            writer.writerow([
-                transaction["transaction_id"],
-                transaction["customer_id"],
-                transaction["transaction_date"],
-                product["product_name"],
-                product["category"],
-                product["amount"],
-                transaction["total_amount"]
-            ])
+def upload_transactions_to_s3(transactions, filename, format_type="csv", compression=None):
+    """Sube las transacciones a S3 en formato CSV, desglosando los productos.
+
+    En formato Parquet los productos se guardan como una lista anidada.
+    """
+    if format_type == "parquet":
+        rows, fieldnames = transactions, None
+    else:
+        # Encabezados: una fila por producto dentro de una transacción
+        fieldnames = ["transaction_id", "customer_id", "transaction_date", "product_name", "category", "amount", "total_amount"]
+
+        # Filas generadas a medida que se sube
+        rows = (
+            {
+                "transaction_id": transaction["transaction_id"],
+                "customer_id": transaction["customer_id"],
+                "transaction_date": transaction["transaction_date"],
+                "product_name": product["product_name"],
+                "category": product["category"],
+                "amount": product["amount"],
+                "total_amount": transaction["total_amount"]
+            }
+            for transaction in transactions
+            for product in transaction["products"]
+        )
 
     # Subir a S3
     try:
-        s3_client.put_object(Bucket=bucket_name, Key=filename, Body=output.getvalue())
+        upload_records(
+            storage, filename, rows, format_type, "transactions_products", fieldnames,
+            compression=compression, stats_columns=stats_columns("transactions_products"),
+        )
         print(f"Transacciones subidas a S3: {filename}")
+        return True
     except Exception as e:
         print(f"Error al subir {filename} a S3: {e}")
+        return False
 
 # Generar transacciones
 def generate_transactions(customers):
@@ -102,20 +136,25 @@ def generate_transactions(customers):
 def main():
     print("Generando datos de transacciones...")
 
-    # Leer clientes desde S3
-    customers_file = "data/json/customers.json"  # Ruta actualizada para clientes
+    # Leer clientes desde S3 (con KEY_SHARDS, los archivos de todos los shards)
+    if shard_count > 0:
+        customers_files = list_shard_keys(storage, "data/json/customers")
+    else:
+        customers_files = [compressed_key("data/json/customers.json", dataset_compression["customers"])]  # Ruta actualizada para clientes
+
+    # Generar transacciones mientras se leen los clientes
     try:
-        response = s3_client.get_object(Bucket=bucket_name, Key=customers_file)
-        customers = json.loads(response["Body"].read().decode("utf-8"))
+        transactions = cluster(generate_transactions(iter_customers(customers_files)), "transactions_products")
     except Exception as e:
-        print(f"Error al leer {customers_file}: {e}")
+        print(f"Error al leer los clientes: {e}")
         return
 
-    # Generar transacciones
-    transactions = generate_transactions(customers)
-
     # Subir transacciones a S3
-    upload_transactions_to_s3(transactions, transactions_file)
+    publish(spool, upload_transactions_to_s3, transactions, filename=transactions_file, format_type=dataset_formats["transactions"], compression=dataset_compression["transactions"])
+
+    # Subir los segmentos del spool (incluidos los pendientes de ejecuciones anteriores)
+    if spool is not None:
+        drain(spool, upload_transactions_to_s3, max_attempts=max_attempts or 5)
     print("Transacciones generadas y subidas correctamente.")
 
 if __name__ == "__main__":
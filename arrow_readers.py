@@ -0,0 +1,94 @@
+import csv
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.json as pajson
+
+# Filas que se convierten a diccionarios de una vez al iterar
+batch_rows = 10000
+
+class ArrowRecords:
+    """Registros respaldados por una tabla Arrow.
+
+    Los diccionarios se crean solo al iterar, un lote de filas a la vez, de
+    modo que leer un archivo no materializa un objeto de Python por celda.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __iter__(self):
+        for batch in self.table.to_batches(max_chunksize=batch_rows):
+            yield from batch.to_pylist()
+
+    @property
+    def fieldnames(self):
+        return self.table.column_names
+
+def input_stream(content, compression=None):
+    """Flujo de lectura sobre el búfer (sin copiarlo), descomprimiéndolo en streaming si corresponde."""
+    stream = pa.BufferReader(content)
+    return pa.CompressedInputStream(stream, compression) if compression else stream
+
+def csv_header(content, compression=None, partial=False):
+    """Nombres de columna del CSV, leyendo solo su primera línea.
+
+    Con `partial` el contenido es solo el comienzo del archivo (un GET por
+    rango): si no alcanza a traer la línea completa se retorna None. El
+    flujo descomprimido se lee byte a byte hasta el primer salto de línea:
+    una lectura que choca con el final de un prefijo comprimido truncado
+    falla sin entregar nada, así solo se pierde ese byte y no lo que ya se
+    había descomprimido.
+    """
+    stream = input_stream(content, compression)
+    head = bytearray()
+    try:
+        while not head.endswith(b"\n"):
+            byte = stream.read(1)
+            if not byte:
+                break
+            head += byte
+    except (pa.ArrowInvalid, OSError):
+        if not partial:
+            raise
+    if partial and not head.endswith(b"\n"):
+        return None
+    line = bytes(head).split(b"\n", 1)[0].decode("utf-8")
+    return next(csv.reader([line]), [])
+
+def read_csv_table(content, compression=None):
+    """Lee un CSV desde un búfer de bytes como tabla Arrow.
+
+    Todas las columnas se leen como texto y las celdas vacías quedan como "",
+    igual que con csv.DictReader.
+    """
+    names = csv_header(content, compression)
+    if not names:
+        return pa.table({})
+    return pacsv.read_csv(
+        input_stream(content, compression),
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(column_types={name: pa.string() for name in names}),
+    )
+
+def read_ndjson_table(content, compression=None, schema=None):
+    """Lee NDJSON desde un búfer de bytes como tabla Arrow.
+
+    Con `schema` las columnas se leen con sus tipos y se ignoran los campos
+    que no están en él; sin él los tipos se infieren.
+    """
+    parse_options = pajson.ParseOptions(explicit_schema=schema, unexpected_field_behavior="ignore") if schema else None
+    return pajson.read_json(input_stream(content, compression), parse_options=parse_options)
+
+def csv_rows_table(rows, fieldnames):
+    """Tabla de texto con filas nuevas, con los valores que tendrían al releer el CSV escrito."""
+    columns = {name: ["" if row.get(name) is None else str(row.get(name)) for row in rows] for name in fieldnames}
+    return pa.table(columns, schema=pa.schema([(name, pa.string()) for name in fieldnames]))
+
+def concat_records(records, table):
+    """Agrega las filas de `table` a los registros (ArrowRecords o lista vacía)."""
+    if isinstance(records, ArrowRecords) and records.table.num_columns:
+        table = pa.concat_tables([records.table, table], promote_options="default")
+    return ArrowRecords(table)
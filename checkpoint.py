@@ -0,0 +1,26 @@
+import json
+import os
+
+# Archivo local con el último lote confirmado del generador continuo
+checkpoint_path = os.environ.get("CHECKPOINT_PATH", "index_checkpoint.json")
+
+def make_batch_id(run_id, seq):
+    """Identificador determinista de un lote: ejecución + número de secuencia."""
+    return f"{run_id}-{seq:08d}"
+
+def load_checkpoint(path=checkpoint_path):
+    """Lee el checkpoint; si no existe retorna un estado vacío."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_checkpoint(state, path=checkpoint_path):
+    """Guarda el checkpoint de forma atómica (archivo temporal + fsync + renombrado)."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
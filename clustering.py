@@ -0,0 +1,116 @@
+import os
+from settings import dataset_options
+
+# Ordenar cada lote por sus columnas de clustering antes de serializarlo, de
+# modo que cada archivo cubra un rango acotado de fechas y claves
+cluster_batches = os.environ.get("CLUSTER_BATCHES", "false").lower() == "true"
+
+# Columnas de clustering por esquema, separadas por "+"
+# (p. ej. CLUSTER_KEYS="transactions=customer_id+purchase_date")
+cluster_keys = dataset_options("CLUSTER_KEYS", {
+    "customers": "customer_id",
+    "transactions": "purchase_date+customer_id",
+    "invoices": "invoice_date",
+    "customers_single_transaction": "customer_id",
+    "transactions_products": "transaction_date+customer_id",
+    "receipts": "receipt_date+customer_id",
+    "inventories": "last_updated+warehouse_id",
+    "inventory_transactions": "transaction_date+warehouse_id",
+})
+
+# Filas por bloque de estadísticas (igual al tamaño de grupo de filas de Parquet)
+block_rows = 10000
+
+# Objeto auxiliar con las estadísticas de los formatos de texto
+stats_prefix = "_stats/"
+
+def clustering_columns(dataset):
+    return [column for column in cluster_keys.get(dataset, "").split("+") if column]
+
+def stats_columns(dataset):
+    """Columnas de las que se registran estadísticas, o None si el clustering está desactivado."""
+    return (clustering_columns(dataset) or None) if cluster_batches else None
+
+def stats_key(key):
+    return f"{stats_prefix}{key}.json"
+
+def sort_key(fields):
+    # Los nulos quedan al final
+    return lambda record: tuple(
+        (record.get(field) is None, "" if record.get(field) is None else record.get(field)) for field in fields
+    )
+
+def cluster(records, dataset):
+    """Ordena el lote por las columnas de clustering del esquema, si está activado."""
+    columns = clustering_columns(dataset)
+    if not cluster_batches or not columns:
+        return records
+    return sorted(records, key=sort_key(columns))
+
+def update_range(stats, column, value):
+    if column not in stats["minValues"] or value < stats["minValues"][column]:
+        stats["minValues"][column] = value
+    if column not in stats["maxValues"] or value > stats["maxValues"][column]:
+        stats["maxValues"][column] = value
+
+def empty_stats(columns, first_row=None):
+    stats = {"numRecords": 0, "minValues": {}, "maxValues": {}, "nullCount": {column: 0 for column in columns}}
+    if first_row is not None:
+        stats["firstRow"] = first_row
+    return stats
+
+class ColumnStats:
+    """Envuelve los registros y calcula min/max de columnas por archivo y por bloque de filas.
+
+    Las estadísticas por archivo siguen el formato de las acciones "add" de
+    Delta (numRecords, minValues, maxValues, nullCount).
+    """
+
+    def __init__(self, records, columns, rows_per_block=block_rows):
+        self._records = records
+        self.columns = columns
+        self.rows_per_block = rows_per_block
+        self.rows = 0
+        self.stats = empty_stats(columns)
+        self.blocks = []
+
+    def __iter__(self):
+        for record in self._records:
+            if self.rows % self.rows_per_block == 0:
+                self.blocks.append(empty_stats(self.columns, first_row=self.rows))
+            block = self.blocks[-1]
+            for stats in (self.stats, block):
+                stats["numRecords"] += 1
+            for column in self.columns:
+                value = record.get(column)
+                for stats in (self.stats, block):
+                    if value is None or value == "":
+                        stats["nullCount"][column] += 1
+                    else:
+                        update_range(stats, column, value)
+            self.rows += 1
+            yield record
+
+    def sidecar(self):
+        """Estadísticas por archivo y por bloque para el objeto auxiliar."""
+        return {**self.stats, "blocks": self.blocks}
+
+def append_stats(sidecar, counter):
+    """Objeto auxiliar de un archivo al que se agregaron al final las filas de `counter`.
+
+    Combina las estadísticas del archivo y agrega los bloques nuevos con su
+    primera fila desplazada por las filas que ya tenía.
+    """
+    stats = {name: value for name, value in sidecar.items() if name != "blocks"}
+    stats["minValues"] = dict(stats["minValues"])
+    stats["maxValues"] = dict(stats["maxValues"])
+    stats["nullCount"] = {
+        column: stats["nullCount"].get(column, 0) + counter.stats["nullCount"][column] for column in counter.columns
+    }
+    for column, value in counter.stats["minValues"].items():
+        update_range(stats, column, value)
+    for column, value in counter.stats["maxValues"].items():
+        update_range(stats, column, value)
+    blocks = [{**block, "firstRow": block["firstRow"] + stats["numRecords"]} for block in counter.blocks]
+    stats["numRecords"] += counter.rows
+    return {**stats, "blocks": sidecar.get("blocks", []) + blocks}
@@ -0,0 +1,231 @@
+import argparse
+import heapq
+import json
+import os
+import pickle
+import tempfile
+import uuid
+from itertools import chain, count, groupby, islice
+import pyarrow as pa
+import pyarrow.parquet as pq
+from arrow_readers import ArrowRecords, read_csv_table, read_ndjson_table
+from clustering import sort_key
+from json_stream import open_json_array
+from compression import extensions, detect_compression, decompress
+from key_sharding import shard_prefixes
+from manifest import load_snapshot, commit_cycle, snapshot_files
+from parquet_writer import schemas, coerce_value, iter_parquet_chunks
+from partitioning import parse_partition_values, bucket_of
+from storage import create_storage, LocalStorage, PreconditionFailed
+from streaming_upload import iter_chunks, record_counter
+
+# Filas que se ordenan en memoria antes de volcar una corrida a disco
+run_rows = int(os.environ.get("COMPACTION_RUN_ROWS", "100000"))
+
+# Filas por archivo Parquet compactado
+output_rows = int(os.environ.get("COMPACTION_OUTPUT_ROWS", "1000000"))
+
+# Directorio de las corridas ordenadas temporales (vacío = el del sistema)
+tmp_root = os.environ.get("COMPACTION_TMP_DIR") or None
+
+# Formatos de datos que se leen; el resto de las claves se ignora
+data_formats = ("json", "ndjson", "csv", "parquet")
+
+def file_format(key):
+    """Formato de un archivo según su extensión, sin la extensión de compresión."""
+    name = key.rsplit("/", 1)[-1]
+    for extension in extensions.values():
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    fmt = name.rpartition(".")[2]
+    return fmt if fmt in data_formats else None
+
+def is_data_file(key):
+    """Excluye el log, el manifiesto y el estado (carpetas que comienzan con "_")."""
+    return file_format(key) is not None and "/_" not in "/" + key
+
+def in_prefix(key, prefix):
+    """Indica si la clave está bajo el prefijo, con o sin prefijo de shard."""
+    return any(key.startswith(candidate) for candidate in shard_prefixes(prefix) + [prefix])
+
+def select_inputs(storage, dataset, prefix):
+    """Archivos a compactar: los del snapshot si el dataset tiene manifiesto, o los listados."""
+    snapshot = load_snapshot(storage, datasets=[dataset])
+    if snapshot["files"].get(dataset):
+        return [entry["path"] for entry in snapshot["files"][dataset] if in_prefix(entry["path"], prefix)]
+    keys = set()
+    for candidate in set(shard_prefixes(prefix) + [prefix]):
+        keys.update(key for key in storage.list(candidate) if is_data_file(key))
+    return sorted(keys)
+
+def iter_file_records(storage, key, schema=None):
+    """Lee los registros de un archivo pequeño (JSON, NDJSON, CSV o Parquet, comprimido o no).
+
+    Los arreglos JSON se decodifican en streaming desde el flujo del objeto.
+    CSV y NDJSON se parsean con los lectores de Arrow directo desde los bytes
+    descargados; un NDJSON que no calza con `schema` se lee línea a línea.
+    """
+    fmt = file_format(key)
+    if fmt == "json":
+        yield from open_json_array(storage, key)
+        return
+    content = storage.get(key)
+    if fmt == "parquet":
+        for batch in pq.ParquetFile(pa.BufferReader(content)).iter_batches():
+            yield from batch.to_pylist()
+        return
+    compression = detect_compression(key)
+    if fmt == "ndjson":
+        try:
+            records = ArrowRecords(read_ndjson_table(content, compression, schema))
+        except pa.ArrowInvalid:
+            text = decompress(content, compression).decode("utf-8")
+            records = (json.loads(line) for line in text.splitlines() if line)
+        yield from records
+    else:
+        yield from ArrowRecords(read_csv_table(content, compression))
+
+def coerce_record(record, schema):
+    """Convierte el registro a los tipos del esquema (los CSV traen todo como texto)."""
+    return {field.name: coerce_value(record.get(field.name), field.type) for field in schema}
+
+def write_run(records, key, directory):
+    """Ordena una corrida en memoria y la vuelca a un archivo temporal."""
+    records.sort(key=key)
+    fd, path = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        for record in records:
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+def iter_run(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def external_sort(records, key, directory, run_size=run_rows):
+    """Ordena con memoria acotada: corridas ordenadas en disco y mezcla con heapq.merge."""
+    runs = [write_run(chunk, key, directory) for chunk in iter_chunks(records, run_size)]
+    return heapq.merge(*(iter_run(path) for path in runs), key=key)
+
+def output_key(prefix, compaction_id, part, bucket=None):
+    separator = "" if prefix.endswith("/") else "-"
+    suffix = "" if bucket is None else f"_{bucket:05d}"
+    return f"{prefix}{separator}{compaction_id}-{part:04d}{suffix}.parquet"
+
+def write_outputs(storage, records, schema_name, prefix, compaction_id, sort_by, rows_per_file=output_rows, bucket=None):
+    """Escribe los registros ordenados en archivos Parquet de hasta `rows_per_file` filas.
+
+    Cada entrada lleva el min/max de las columnas de orden para descartar
+    archivos al leer y, si se indica, el bucket de sus registros.
+    """
+    entries = []
+    records = iter(records)
+    for part in count():
+        first = next(records, None)
+        if first is None:
+            return entries
+        counter, footer = record_counter(chain([first], islice(records, rows_per_file - 1)), "parquet", sort_by)
+        key = output_key(prefix, compaction_id, part, bucket)
+        size = storage.put_chunks(key, iter_parquet_chunks(counter, schema_name, footer=footer))
+        entries.append({
+            "path": key, "batch_id": compaction_id, "format": "parquet", "size": size, "rows": counter.rows,
+            "stats": counter.stats,
+        })
+        if bucket is not None:
+            entries[-1]["bucket"] = bucket
+        print(f"Archivo compactado: {key} ({counter.rows} filas)")
+
+def compact(storage, prefix, schema_name, sort_by, dataset=None, delete_inputs=False,
+            run_size=run_rows, rows_per_file=output_rows, attempts=5):
+    """Compacta los archivos pequeños de una partición en pocos Parquet grandes y ordenados.
+
+    Los archivos nuevos se publican reemplazando a los anteriores en un único
+    commit del manifiesto; los lectores ven los archivos viejos o los nuevos,
+    nunca ambos. Si otro escritor confirma antes, el commit se reintenta sobre
+    el snapshot nuevo. Los originales solo se borran con `delete_inputs`.
+    """
+    dataset = dataset or schema_name
+    schema = schemas[schema_name]
+    unknown = [field for field in sort_by if field not in schema.names]
+    if unknown:
+        raise ValueError(f"Campos de orden desconocidos para {schema_name}: {', '.join(unknown)}")
+
+    # En un dataset con particiones Hive el prefijo debe fijarlas todas, para
+    # no mezclar particiones en un mismo archivo compactado
+    table = load_snapshot(storage, datasets=[])["metadata"].get(dataset, {})
+    partition_columns = table.get("partitionColumns", [])
+    partition_values = {
+        column: value for column, value in parse_partition_values(prefix).items() if column in partition_columns
+    }
+    missing = [column for column in partition_columns if column not in partition_values]
+    if missing:
+        raise ValueError(f"El prefijo {prefix} no fija las columnas de partición: {', '.join(missing)}")
+
+    inputs = select_inputs(storage, dataset, prefix)
+    if len(inputs) < 2:
+        print(f"Nada que compactar en {prefix} ({len(inputs)} archivos)")
+        return []
+
+    compaction_id = f"compact-{uuid.uuid4().hex}"
+    records = (coerce_record(record, schema) for key in inputs for record in iter_file_records(storage, key, schema))
+    with tempfile.TemporaryDirectory(dir=tmp_root) as directory:
+        if table.get("numBuckets"):
+            # Con buckets se ordena primero por bucket y cada uno va a sus propios archivos
+            bucket_by, buckets = table["bucketColumns"][0], table["numBuckets"]
+            bucket_key = lambda record: bucket_of(record[bucket_by], buckets)
+            by_fields = sort_key(sort_by)
+            merged = external_sort(records, lambda record: (bucket_key(record), by_fields(record)), directory, run_size)
+            entries = []
+            for bucket, group in groupby(merged, key=bucket_key):
+                entries.extend(write_outputs(storage, group, schema_name, prefix, compaction_id, sort_by, rows_per_file, bucket))
+        else:
+            merged = external_sort(records, sort_key(sort_by), directory, run_size)
+            entries = write_outputs(storage, merged, schema_name, prefix, compaction_id, sort_by, rows_per_file)
+    if partition_columns:
+        for entry in entries:
+            entry["partitionValues"] = partition_values
+
+    for attempt in range(attempts):
+        try:
+            snapshot = load_snapshot(storage, datasets=[dataset])
+            if snapshot["files"].get(dataset) and not set(inputs) <= set(snapshot_files(snapshot, dataset)):
+                raise RuntimeError(f"Los archivos de {prefix} cambiaron durante la compactación")
+            commit_cycle(storage, snapshot, compaction_id, {dataset: entries}, {dataset: inputs}, operation="OPTIMIZE")
+            break
+        except (PreconditionFailed, RuntimeError) as e:
+            # Otro escritor confirmó antes: se reintenta con el snapshot nuevo
+            # (las versiones del log ya escritas se reutilizan), salvo que los
+            # archivos de entrada ya no estén vigentes
+            if isinstance(e, PreconditionFailed) and attempt < attempts - 1:
+                continue
+            storage.delete(entry["path"] for entry in entries)
+            raise
+
+    if delete_inputs:
+        storage.delete(inputs)
+    print(f"Compactados {len(inputs)} archivos de {prefix} en {len(entries)}")
+    return entries
+
+def main():
+    parser = argparse.ArgumentParser(description="Compacta los archivos pequeños de una partición en Parquet ordenado.")
+    parser.add_argument("prefix", help="Prefijo de la partición, p. ej. data/customers/dt=2024-01-01/")
+    parser.add_argument("--schema", required=True, choices=sorted(schemas), help="Esquema de los registros")
+    parser.add_argument("--sort-by", required=True, help="Campos de orden separados por coma")
+    parser.add_argument("--dataset", help="Dataset del manifiesto (por defecto, el esquema)")
+    parser.add_argument("--local-root", help="Directorio local a usar en lugar del backend configurado")
+    parser.add_argument("--bucket", default="data-lake-simulacion")
+    parser.add_argument("--delete-inputs", action="store_true", help="Borra los archivos originales tras el commit")
+    args = parser.parse_args()
+
+    if args.local_root:
+        storage = LocalStorage(args.local_root)
+    else:
+        storage = create_storage(args.bucket)
+    compact(storage, args.prefix, args.schema, args.sort_by.split(","), args.dataset, args.delete_inputs)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import pyarrow as pa
+from parquet_writer import ChunkSink
+
+# Extensión de archivo por códec de compresión
+extensions = {
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+def normalize(compression):
+    """Retorna el códec configurado o None si no se comprime ("none", vacío)."""
+    if not compression or compression == "none":
+        return None
+    if compression not in extensions:
+        raise ValueError(f"Compresión no soportada: {compression}")
+    return compression
+
+def compressed_key(key, compression):
+    """Agrega la extensión del códec a la clave (Parquet comprime internamente)."""
+    compression = normalize(compression)
+    if compression is None or key.endswith(".parquet"):
+        return key
+    return key + extensions[compression]
+
+def detect_compression(key, content_encoding=None):
+    """Determina el códec de un objeto a partir de su ContentEncoding o su extensión."""
+    if content_encoding in extensions:
+        return content_encoding
+    for compression, extension in extensions.items():
+        if key.endswith(extension):
+            return compression
+    return None
+
+def iter_compressed(chunks, compression):
+    """Comprime en streaming los bloques de bytes con el códec de pyarrow.
+
+    El primer bloque (el encabezado, en CSV) cierra su propio bloque
+    comprimido: un GET por rango de los primeros KiB basta para
+    descomprimirlo, también en zstd, que solo entrega bloques completos.
+    """
+    sink = ChunkSink()
+    stream = pa.CompressedOutputStream(sink, compression)
+    for index, chunk in enumerate(chunks):
+        stream.write(chunk)
+        if index == 0:
+            stream.flush()
+        data = sink.drain()
+        if data:
+            yield data
+    stream.close()
+    yield sink.drain()
+
+def open_decompressed(stream, compression):
+    """Envuelve un flujo binario para descomprimirlo en streaming; sin códec lo retorna tal cual."""
+    if compression is None:
+        return stream
+    return pa.CompressedInputStream(pa.PythonFile(stream, mode="r"), compression)
+
+def decompress(content, compression):
+    """Descomprime el contenido completo de un objeto; sin códec lo retorna tal cual."""
+    if compression is None:
+        return content
+    return pa.CompressedInputStream(pa.BufferReader(content), compression).read()
@@ -0,0 +1,32 @@
+import hashlib
+import json
+from storage import ObjectNotFound
+
+# Objeto de estado con el último digest publicado por dataset
+state_key = "data/_state/content_digests.json"
+
+def compute_digest(records, fields=None):
+    """Calcula un digest del conjunto de registros, independiente de su orden.
+
+    Con `fields` solo se consideran esos campos (el contenido "lógico").
+    """
+    rows = sorted(
+        json.dumps({field: record.get(field) for field in fields} if fields else record, sort_keys=True, default=str)
+        for record in records
+    )
+    hasher = hashlib.sha256()
+    for row in rows:
+        hasher.update(row.encode("utf-8"))
+        hasher.update(b"\n")
+    return hasher.hexdigest()
+
+def load_digests(storage, key=state_key):
+    """Lee los digests publicados; si el estado no existe retorna un diccionario vacío."""
+    try:
+        return json.loads(storage.get(key).decode("utf-8"))
+    except ObjectNotFound:
+        return {}
+
+def save_digests(storage, digests, key=state_key):
+    """Guarda los digests publicados en el objeto de estado."""
+    storage.put(key, json.dumps(digests, indent=4, sort_keys=True))
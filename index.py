@@ -1,20 +1,82 @@
-import boto3
+from botocore.config import Config
 from faker import Faker
 import random
 import json
-import csv
 import time
 from datetime import datetime
-import io
+import os
+import uuid
+import queue
+import threading
+from itertools import count
+from itertools import chain
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from settings import dataset_options
+from parquet_writer import to_table
+from arrow_readers import ArrowRecords, read_csv_table, csv_header, csv_rows_table, concat_records
+from compression import compressed_key, detect_compression, decompress
+from content_digest import compute_digest, load_digests, save_digests
+from key_sharding import sharded_key
+from rollover import RolloverPolicy, generate_records
+from spool import spool_directory, publish, drain_forever
+from checkpoint import make_batch_id, load_checkpoint, save_checkpoint
+from manifest import load_snapshot, commit_cycle
+from storage import create_storage, ObjectNotFound, download_concurrency
+from clustering import cluster, stats_columns, stats_key, append_stats
+from partitioning import columns_of, bucket_column, bucket_count, split_partitions, partition_path, max_open_writers
+from s3_scheduler import scheduler
+from io_metrics import io_metrics, MeteredStorage
+from object_cache import ObjectCache
+from streaming_upload import upload_records, max_concurrency, SerializedRecords, record_counter, iter_serialized, content_encoding_args
 
-# Configuración de S3
+# Datasets que se suben en paralelo en cada ciclo
+upload_workers = int(os.environ.get("UPLOAD_WORKERS", "5"))
+
+# Ciclo continuo: intervalo entre subidas, lotes generados por adelantado
+# (0 = generar y subir en secuencia) y serialización previa en el productor
+cycle_interval = int(os.environ.get("CYCLE_INTERVAL_SECONDS", str(12 * 60)))
+prefetch_batches = int(os.environ.get("PREFETCH_BATCHES", "1"))
+preserialize = os.environ.get("PRESERIALIZE", "false").lower() == "true"
+retry_interval = int(os.environ.get("UPLOAD_RETRY_SECONDS", "30"))
+
+# Lotes deterministas: cada lote se identifica por RUN_ID + número de secuencia
+# (las claves se sobrescriben al reintentar) y el checkpoint registra el último
+# lote confirmado para reanudar en el siguiente tras un reinicio
+checkpoint_state = {}
+
+# Manifiesto (WRITE_MANIFEST): log de transacciones por dataset y snapshot
+# data/_manifest/_latest.json; los archivos de un lote se vuelven visibles
+# juntos cuando todos terminaron de subirse y los lectores los resuelven con el
+# último checkpoint de cada dataset y las pocas versiones del log posteriores
+use_manifest = os.environ.get("WRITE_MANIFEST", "true").lower() == "true"
+
+# Spool local durable (SPOOL_DIR): los lotes se escriben en disco y un hilo
+# aparte los sube con reintentos, de modo que la generación no se detiene
+# cuando S3 responde lento y los lotes pendientes se reenvían tras una caída
+spool = spool_directory("index")
+
+# Almacenamiento (STORAGE_BACKEND: "s3", "local" o "memory"). En S3 un cliente
+# compartido por todos los hilos, con conexiones suficientes para las partes
+# concurrentes de cada subida (una por partición abierta de cada dataset) o
+# descarga. Cada operación se registra en io_metrics, que se emite al final de
+# cada ciclo (IO_METRICS, IO_METRICS_EMF)
 bucket_name = "data-lake-simulacion"  # Nombre del bucket S3
-s3_client = boto3.client('s3')
+storage = MeteredStorage(create_storage(bucket_name, Config(
+    max_pool_connections=upload_workers * max(max_open_writers * (max_concurrency + 1), download_concurrency + 1),
+    tcp_keepalive=True,
+)), io_metrics)
+
+# Caché de los archivos legacy ya parseados: en cada ciclo se revalidan con
+# su ETag y, como este proceso los escribió, normalmente no se descargan
+object_cache = ObjectCache(bucket_name)
 
 # Carpetas específicas por tipo de archivo
 folders = {
     "json": "data/json/",
     "csv": "data/csv/",
+    "parquet": "data/parquet/",
 }
 
 # Archivos en sus carpetas respectivas
@@ -26,32 +88,133 @@ file_paths = {
     "invoices": folders["json"] + "invoices.json",  # Cambiado de Parquet a JSON
 }
 
+# Modo de escritura:
+#   "legacy" (por defecto): archivo único por dataset (lee, concatena y
+#             reescribe todo); los generadores leen data/json/customers.json
+#   "partitioned": cada ciclo escribe un objeto nuevo e inmutable por dataset
+#                  (data/<dataset>/dt=YYYY-MM-DD/hour=HH/batch-<id>.<ext>)
+# En modo particionado KEY_SHARDS antepone un prefijo hash del lote a la clave
+write_mode = os.environ.get("WRITE_MODE", "legacy")
+
+# En modo legacy los CSV se amplían agregando solo las filas del lote al final
+# del objeto, tras validar su encabezado con un GET por rango de CSV_HEADER_KB
+# (CSV_APPEND=false vuelve a leer y reescribir el archivo completo)
+csv_append = os.environ.get("CSV_APPEND", "true").lower() == "true"
+csv_header_bytes = int(os.environ.get("CSV_HEADER_KB", "8")) * 1024
+
+# Formato de salida por dataset: "json", "csv" o "parquet"
+# (p. ej. OUTPUT_FORMATS="customers=parquet,invoices=parquet")
+dataset_formats = dataset_options("OUTPUT_FORMATS", {
+    "customers": "json",
+    "transactions": "csv",
+    "providers": "csv",
+    "products": "json",
+    "invoices": "json",
+})
+
+# Compresión por dataset: "none", "gzip" o "zstd"
+# (p. ej. OUTPUT_COMPRESSION="customers=zstd,transactions=gzip")
+dataset_compression = dataset_options("OUTPUT_COMPRESSION", {
+    "customers": "none",
+    "transactions": "none",
+    "providers": "none",
+    "products": "none",
+    "invoices": "none",
+})
+
+# Omitir la subida de datasets cuyo contenido lógico no cambió desde la última
+# publicación; None compara el registro completo. Solo se listan datasets con
+# campos estables entre ciclos: los proveedores se generan al azar en cada
+# ciclo (id, nombre, correo), su digest nunca coincidiría y solo costaría
+# serializarlos y hashearlos
+skip_unchanged = os.environ.get("SKIP_UNCHANGED", "true").lower() == "true"
+digest_fields = {
+    "products": ["category", "name"],
+}
+
+# Último digest publicado por dataset (se carga desde S3 al iniciar)
+published_digests = {}
+
+# Tamaño de los lotes: sin TARGET_OBJECT_MB/TARGET_OBJECT_ROWS se generan 200
+# clientes y 50 proveedores por ciclo; con objetivo, la cantidad se ajusta
+# según los objetos que se escribieron en los ciclos anteriores. Los clientes
+# también fijan el tamaño de sus transacciones y facturas
+customers_policy = RolloverPolicy(initial_batch_size=200)
+providers_policy = RolloverPolicy(initial_batch_size=50)
+size_policies = {
+    "customers": ("customers", customers_policy),
+    "transactions": ("customers", customers_policy),
+    "invoices": ("customers", customers_policy),
+    "providers": ("providers", providers_policy),
+}
+
 # Cargar nombres de productos desde el archivo JSON
 with open("product_names.json", "r") as f:
     product_names = json.load(f)
 
+# Categoría de cada producto (el grupo de product_names.json), para particionar
+# por categoría los datasets que solo traen el nombre del producto
+product_categories = {name: category for category, names in product_names.items() for name in names}
+derived_columns = {
+    "category": lambda record: product_categories.get(record.get("product_name")),
+}
+
 # Inicializar Faker
 fake = Faker()
 
+# Generador aleatorio propio de la generación; se siembra con el id de cada lote
+# para que un lote reintentado produzca los mismos datos
+rng = random.Random()
+
 # Generar datos comunes
 shared_transactions = []
 
+def parse_existing_data(content, filename, format_type):
+    """Parsea el contenido de un archivo legacy y retorna los datos y su tamaño decodificado.
+
+    CSV y Parquet se leen directo desde los bytes a una tabla Arrow
+    (ArrowRecords): los diccionarios se crean solo al recorrer los registros.
+    El tamaño (el de la tabla o el del JSON descomprimido) es con el que los
+    datos cuentan en la caché de objetos.
+    """
+    if format_type == "json":
+        text = decompress(content, detect_compression(filename))
+        return json.loads(text.decode("utf-8")), len(text)
+    elif format_type == "csv":
+        records = ArrowRecords(read_csv_table(content, detect_compression(filename)))
+        return (records, records.fieldnames or None), records.table.nbytes
+    elif format_type == "parquet":
+        records = ArrowRecords(pq.read_table(pa.BufferReader(content)))
+        return records, records.table.nbytes
+    return [], 0
+
+def merged_records(existing_data, data, format_type, dataset, fieldnames, size):
+    """Registros existentes más los del lote y su tamaño decodificado, como los retorna parse_existing_data.
+
+    Solo el lote se convierte a Arrow; la tabla ya leída no se copia. `size`
+    es el tamaño del JSON escrito sin comprimir, o None si no se conoce.
+    """
+    if format_type == "csv":
+        fieldnames = fieldnames or list(data[0].keys())
+        records = concat_records(existing_data, csv_rows_table(data, fieldnames))
+        return (records, fieldnames), records.table.nbytes
+    elif format_type == "parquet":
+        records = concat_records(existing_data, to_table(data, dataset))
+        return records, records.table.nbytes
+    return list(chain(existing_data, data)), size
+
 def read_existing_data(filename, format_type):
-    """Lee datos existentes desde S3 y los retorna."""
+    """Lee datos existentes del almacenamiento y los retorna, descomprimiéndolos si corresponde.
+
+    La lectura pasa por la caché de objetos: si el archivo no cambió desde la
+    última lectura o escritura no se descarga ni se vuelve a parsear.
+    Solo un objeto inexistente equivale a no tener datos: cualquier otro error
+    (p. ej. SlowDown tras agotar los reintentos) se propaga para no reescribir
+    el archivo legacy sin su contenido anterior.
+    """
     try:
-        response = s3_client.get_object(Bucket=bucket_name, Key=filename)
-        content = response["Body"].read()
-        if format_type == "json":
-            return json.loads(content.decode("utf-8"))
-        elif format_type == "csv":
-            csv_content = content.decode("utf-8")
-            reader = csv.DictReader(io.StringIO(csv_content))
-            return list(reader), reader.fieldnames
-        return []
-    except s3_client.exceptions.NoSuchKey:
-        return []
-    except Exception as e:
-        print(f"Error al leer {filename}: {e}")
+        return object_cache.read(storage, filename, lambda content: parse_existing_data(content, filename, format_type))
+    except ObjectNotFound:
         return []
 
 def generate_customer_data():
@@ -64,10 +227,10 @@ def generate_customer_data():
     # Generar transacciones asociadas al cliente
     purchase_history = []
     total_spent = 0
-    for _ in range(random.randint(1, 5)):
-        category = random.choice(list(product_names.keys()))
-        product_name = random.choice(product_names[category])
-        amount = round(random.uniform(20.0, 2000.0), 2)
+    for _ in range(rng.randint(1, 5)):
+        category = rng.choice(list(product_names.keys()))
+        product_name = rng.choice(product_names[category])
+        amount = round(rng.uniform(20.0, 2000.0), 2)
         transaction_id = fake.uuid4()
         purchase_date = fake.date_time_this_year().strftime("%Y-%m-%d %H:%M:%S")
         total_spent += amount
@@ -100,22 +263,23 @@ def generate_customer_data():
 
     return customer_data
 
-def generate_providers_data():
+def generate_provider_data():
     """Genera un proveedor único."""
-    providers = []
-    for _ in range(50):
-        provider_id = fake.uuid4()
-        provider_name = fake.company()
-        product_category = random.choice(list(product_names.keys()))
-        product_name = random.choice(product_names[product_category])
-        contact_email = fake.email()
-        providers.append({
-            "provider_id": provider_id,
-            "provider_name": provider_name,
-            "product_name": product_name,
-            "contact_email": contact_email
-        })
-    return providers
+    provider_id = fake.uuid4()
+    provider_name = fake.company()
+    product_category = rng.choice(list(product_names.keys()))
+    product_name = rng.choice(product_names[product_category])
+    contact_email = fake.email()
+    return {
+        "provider_id": provider_id,
+        "provider_name": provider_name,
+        "product_name": product_name,
+        "contact_email": contact_email
+    }
+
+def generate_providers_data():
+    """Genera los proveedores del ciclo según la política de tamaño."""
+    return generate_records(generate_provider_data, providers_policy)
 
 def generate_products_data():
     """Genera un conjunto de productos en formato JSON."""
@@ -125,75 +289,465 @@ def generate_products_data():
             products.append({
                 "category": category,
                 "name": product,
-                "price": round(random.uniform(20.0, 2000.0), 2)
+                "price": round(rng.uniform(20.0, 2000.0), 2)
             })
     return products
 
 def generate_invoices_data():
-    """Genera facturas en formato JSON."""
+    """Genera facturas en formato JSON.
+
+    Cada factura lleva el customer_id de su transacción, para agruparla en el
+    mismo bucket que el cliente y la transacción.
+    """
     invoices = []
     for transaction in shared_transactions:
         invoice_id = fake.uuid4()
         invoices.append({
             "invoice_id": str(invoice_id),
             "transaction_id": transaction["transaction_id"],
+            "customer_id": transaction["customer_id"],
             "amount": float(transaction["amount"]),
             "invoice_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         })
     return invoices
 
-def upload_to_s3(data, file_path, format_type="json"):
-    """Sube datos a S3 organizados por carpetas."""
-    if format_type == "json":
+def build_partitioned_key(dataset, format_type, batch_id, timestamp, partition="", bucket=None):
+    """Construye la clave de un lote particionada por fecha y hora.
+
+    `partition` son las carpetas col=valor/ de las columnas de partición, que
+    van antes de la fecha; el bucket se agrega al nombre del archivo (_00003).
+    """
+    suffix = "" if bucket is None else f"_{bucket:05d}"
+    return (
+        f"data/{dataset}/{partition}dt={timestamp.strftime('%Y-%m-%d')}/hour={timestamp.strftime('%H')}/"
+        f"batch-{batch_id}{suffix}.{format_type}"
+    )
+
+def resolve_key(dataset, format_type, batch_id, timestamp, partition="", bucket=None):
+    """Retorna la clave destino del dataset según el modo de escritura y la compresión."""
+    if write_mode != "legacy":
+        key = sharded_key(build_partitioned_key(dataset, format_type, batch_id, timestamp, partition, bucket), batch_id)
+    elif file_paths[dataset].endswith("." + format_type):
+        key = file_paths[dataset]
+    else:
+        key = folders[format_type] + f"{dataset}.{format_type}"
+    return compressed_key(key, dataset_compression[dataset])
+
+def legacy_info(file_path):
+    """Tamaño, ETag y metadatos del archivo legacy, o None si aún no existe."""
+    try:
+        return storage.head(file_path)
+    except ObjectNotFound:
+        return None
+
+def read_csv_header(file_path, size, compression):
+    """Columnas de un CSV leídas con GETs por rango del comienzo del archivo.
+
+    El rango se duplica hasta que trae la primera línea completa.
+    """
+    end = csv_header_bytes
+    while True:
+        header = csv_header(storage.get_range(file_path, 0, min(end, size)), compression, partial=end < size)
+        if header is not None:
+            return header
+        end *= 2
+
+def append_csv(data, file_path, info, dataset, compression, metadata):
+    """Agrega las filas del lote al final de un CSV legacy sin leer ni reescribir su historial.
+
+    Solo se leen el encabezado (GET por rango) y, con clustering, el objeto
+    auxiliar de estadísticas. Retorna None si el archivo no se puede ampliar
+    así (no registra su conteo de filas, sus columnas no son las del lote o
+    faltan sus estadísticas); en ese caso se reescribe completo.
+    """
+    if "row-count" not in info["metadata"]:
+        return None
+    fieldnames = read_csv_header(file_path, info["size"], detect_compression(file_path, info["content_encoding"]))
+    if set(fieldnames) != set(data[0].keys()):
+        print(f"Las columnas de {file_path} no coinciden con las del lote; se reescribe el archivo")
+        return None
+    columns = stats_columns(dataset)
+    sidecar = None
+    if columns:
+        try:
+            sidecar = json.loads(storage.get(stats_key(file_path)))
+        except ObjectNotFound:
+            return None
+        if set(sidecar["nullCount"]) != set(columns):
+            return None
+
+    counter, _ = record_counter(data, "csv", columns)
+    body = b"".join(iter_serialized(counter, "csv", fieldnames=fieldnames, compression=compression, header=False))
+    rows = int(info["metadata"]["row-count"]) + counter.rows
+    extra_args = content_encoding_args("csv", compression, {"Metadata": {**metadata, "row-count": str(rows)}})
+    size = storage.append(file_path, body, info["size"], info["etag"], extra_args)
+    object_cache.discard(file_path)
+
+    result = {"size": size, "rows": rows}
+    if sidecar is not None:
+        sidecar = append_stats(sidecar, counter)
+        storage.put(stats_key(file_path), json.dumps(sidecar, default=str))
+        result["stats"] = {name: value for name, value in sidecar.items() if name != "blocks"}
+    return result
+
+def upload_to_s3(data, file_path, format_type="json", append=True, dataset=None, compression=None, batch_id=None):
+    """Sube datos a S3 organizados por carpetas.
+
+    Con append=True se leen los datos existentes y se reescribe el archivo
+    completo (modo legacy), salvo en CSV, donde con CSV_APPEND solo se
+    agregan las filas del lote; con append=False solo se escribe el lote.
+    Los registros se serializan en streaming hacia una subida multiparte.
+    El formato "parquet" usa el esquema explícito del dataset.
+    Los errores de subida se propagan para que el ciclo los reporte.
+    El id del lote se guarda en los metadatos del objeto; en modo legacy un
+    lote que ya fue agregado no se vuelve a agregar.
+    Retorna la entrada del archivo para el manifiesto.
+    """
+    entry = {"path": file_path, "batch_id": batch_id, "format": format_type}
+    info = legacy_info(file_path) if append else None
+    if batch_id and info and info["metadata"].get("batch-id") == batch_id:
+        print(f"El lote {batch_id} ya está en {file_path}; se omite")
+        return entry
+
+    metadata = {"batch-id": batch_id} if batch_id else {}
+    if info and csv_append and format_type == "csv":
+        data = list(data)
+        appended = data and append_csv(data, file_path, info, dataset, compression, metadata)
+        if appended:
+            print(f"Filas agregadas a S3: {file_path}")
+            return {**entry, **appended}
+
+    fieldnames = None
+    records = data
+    if append:
         existing_data = read_existing_data(file_path, format_type)
-        data = existing_data + data
-        data = json.dumps(data, indent=4)
+        if isinstance(existing_data, tuple):
+            existing_data, fieldnames = existing_data
+        data = list(data)
+        records = chain(existing_data, data)
+        # Filas del archivo completo, para poder ampliarlo luego sin leerlo
+        metadata["row-count"] = str(len(existing_data) + len(data))
 
-    elif format_type == "csv":
-        result = read_existing_data(file_path, format_type)
-        if isinstance(result, tuple):
-            existing_data, fieldnames = result
+    extra_args = {"Metadata": metadata} if metadata else None
+    stats = upload_records(
+        storage, file_path, records, format_type, dataset, fieldnames, extra_args,
+        compression=compression, stats_columns=stats_columns(dataset),
+    )
+    print(f"Datos subidos a S3: {file_path}")
+
+    # El archivo completo ya se leyó: se guarda en la caché, con el lote
+    # agregado y su nuevo ETag, para que el próximo ciclo no lo descargue. Un
+    # JSON comprimido no se guarda: su tamaño decodificado no se conoce hasta leerlo
+    if append and (existing_data or data) and object_cache.max_bytes > 0 and format_type in ("json", "csv", "parquet"):
+        json_size = None if detect_compression(file_path) else stats["size"]
+        merged, size = merged_records(existing_data, data, format_type, dataset, fieldnames, json_size)
+        if size is not None:
+            object_cache.store(file_path, storage.head(file_path)["etag"], merged, size)
+    return {**entry, **stats}
+
+def upload_partition(dataset, data, batch_id, batch_time, values=None, bucket=None):
+    """Sube un archivo del dataset (una partición o bucket, si se indican) y retorna su entrada."""
+    format_type = dataset_formats[dataset]
+    file_path = resolve_key(dataset, format_type, batch_id, batch_time, partition_path(values or {}), bucket)
+    entry = publish(
+        spool, upload_to_s3, data, file_path=file_path, format_type=format_type,
+        append=write_mode == "legacy", dataset=dataset, compression=dataset_compression[dataset], batch_id=batch_id,
+    )
+    # Con spool el archivo se sube después; su tamaño se completa al confirmar el lote
+    entry = entry or {"path": file_path, "batch_id": batch_id, "format": format_type}
+    if values:
+        entry["partitionValues"] = values
+    if bucket is not None:
+        entry["bucket"] = bucket
+    return entry
+
+def upload_dataset(dataset, data, batch_id, batch_time):
+    """Sube un dataset con el formato y modo de escritura configurados y retorna sus entradas.
+
+    Un dataset particionado llega como {(carpetas, bucket): (valores, registros)}
+    y se sube un archivo por partición y bucket, con a lo sumo
+    `max_open_writers` a la vez.
+    """
+    if not isinstance(data, dict):
+        return [upload_partition(dataset, data, batch_id, batch_time)]
+    with ThreadPoolExecutor(max_workers=max_open_writers) as executor:
+        futures = [
+            executor.submit(upload_partition, dataset, records, batch_id, batch_time, values, bucket)
+            for (_, bucket), (values, records) in data.items()
+        ]
+        return [future.result() for future in futures]
+
+def table_metadata(snapshot, datasets):
+    """Propiedades de tabla (metaData del log) de los datasets en que cambiaron."""
+    metadata = {}
+    for dataset in datasets:
+        properties = {"partitionColumns": columns_of(dataset) if write_mode != "legacy" else []}
+        if write_mode != "legacy" and bucket_column(dataset):
+            properties.update(bucketColumns=[bucket_column(dataset)], numBuckets=bucket_count)
+        if snapshot["metadata"].get(dataset) != properties:
+            metadata[dataset] = properties
+    return metadata
+
+def commit_batch(batch_id, added):
+    """Confirma en el manifiesto los archivos subidos de un lote.
+
+    El snapshot se lee en cada commit porque la compactación también lo actualiza.
+    """
+    snapshot = load_snapshot(storage, datasets=[])
+    commit_cycle(storage, snapshot, batch_id, added, metadata=table_metadata(snapshot, added))
+    print(f"Lote {batch_id} confirmado en el manifiesto")
+
+def run_spooled(records, operation="upload", **metadata):
+    """Ejecuta una operación guardada en el spool: la subida de un dataset o el commit de un lote."""
+    if operation == "commit":
+        return commit_batch(**metadata)
+    return upload_to_s3(records, **metadata)
+
+def upload_batch(datasets, batch_id, batch_time, digests=None):
+    """Sube en paralelo los datasets de un ciclo.
+
+    Retorna las entradas de los archivos subidos y los errores, por dataset.
+
+    Los datasets cuyo digest coincide con el último publicado no se suben.
+    """
+    digests = {dataset: digest for dataset, digest in (digests or {}).items() if dataset in datasets}
+    unchanged = [dataset for dataset, digest in digests.items() if published_digests.get(dataset) == digest]
+    for dataset in unchanged:
+        print(f"Sin cambios en {dataset}; se omite la subida")
+
+    added = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=upload_workers) as executor:
+        futures = {
+            executor.submit(upload_dataset, dataset, data, batch_id, batch_time): dataset
+            for dataset, data in datasets.items()
+            if dataset not in unchanged
+        }
+        for future in as_completed(futures):
+            try:
+                added[futures[future]] = future.result()
+            except Exception as e:
+                errors[futures[future]] = e
+
+    # Registrar los digests de los datasets publicados en este ciclo
+    published = {
+        dataset: digest for dataset, digest in digests.items()
+        if dataset not in unchanged and dataset not in errors
+    }
+    if published:
+        published_digests.update(published)
+        try:
+            save_digests(storage, published_digests)
+        except Exception as e:
+            print(f"Error al guardar los digests publicados: {e}")
+    return added, errors
+
+def serialize(dataset, data):
+    """Serializa por adelantado los registros de un dataset (o de una de sus particiones)."""
+    return SerializedRecords(
+        data, dataset_formats[dataset], dataset,
+        compression=dataset_compression[dataset], stats_columns=stats_columns(dataset),
+    )
+
+def generate_batch(seq, batch_time=None):
+    """Genera los datasets del lote `seq` junto con su identificador.
+
+    La marca de tiempo se asigna al empezar a subir el lote (ver stamp_batch),
+    no al generarlo: con generación por adelantado el lote puede esperar en
+    la cola. `batch_time` permite reutilizar la marca de un lote que quedó a
+    medias.
+    """
+    # Limpiar transacciones compartidas antes de cada iteración
+    shared_transactions.clear()
+
+    # Identificador del lote (común a todos los datasets)
+    batch_id = make_batch_id(checkpoint_state["run_id"], seq)
+    rng.seed(batch_id)
+    fake.seed_instance(batch_id)
+
+    # Generar y acumular datos
+    customers = generate_records(generate_customer_data, customers_policy)
+    providers = generate_providers_data()
+
+    datasets = {
+        "customers": customers,
+        "transactions": list(shared_transactions),
+        "providers": providers,
+        "products": generate_products_data(),
+        "invoices": generate_invoices_data(),
+    }
+
+    # Con CLUSTER_BATCHES cada lote se ordena por fecha y cliente, de modo
+    # que cada archivo cubre un rango acotado y se puede descartar por min/max
+    datasets = {dataset: cluster(data, dataset) for dataset, data in datasets.items()}
+
+    # Digest del contenido lógico, calculado antes de serializar
+    digests = {}
+    if skip_unchanged:
+        digests = {dataset: compute_digest(datasets[dataset], fields) for dataset, fields in digest_fields.items()}
+
+    # Con PARTITION_COLUMNS y BUCKET_COUNT cada dataset se reparte en particiones
+    # Hive y buckets ({(carpetas, bucket): (valores, registros)}); el modo legacy
+    # escribe un único archivo
+    if write_mode != "legacy":
+        datasets = {
+            dataset: (
+                split_partitions(data, columns_of(dataset), derived_columns, bucket_column(dataset))
+                if columns_of(dataset) or bucket_column(dataset) else data
+            )
+            for dataset, data in datasets.items()
+        }
+
+    # En modo particionado el lote no se combina con datos previos y puede
+    # serializarse aquí (con spool los registros se guardan sin serializar)
+    if preserialize and write_mode != "legacy" and spool is None:
+        datasets = {
+            dataset: (
+                {group: (values, serialize(dataset, records)) for group, (values, records) in data.items()}
+                if isinstance(data, dict) else serialize(dataset, data)
+            )
+            for dataset, data in datasets.items()
+        }
+
+    return {
+        "seq": seq, "batch_id": batch_id, "batch_time": batch_time, "datasets": datasets, "digests": digests,
+        "generated": {"customers": len(customers), "providers": len(providers)},
+    }
+
+def observe_written(batch, added):
+    """Alimenta las políticas de tamaño con los objetos escritos del lote.
+
+    En modo legacy el objeto es el archivo completo: se toma lo que el lote
+    le agregó, con los bytes por fila del archivo. Los archivos subidos desde
+    el spool todavía no tienen tamaño y no se cuentan.
+    """
+    for dataset, (driver, policy) in size_policies.items():
+        if not policy.has_target():
+            continue
+        entries = [entry for entry in added.get(dataset, []) if entry.get("size") and entry.get("rows")]
+        if write_mode == "legacy":
+            rows = len(batch["datasets"].get(dataset, []))
+            objects = [(rows, rows * entry["size"] / entry["rows"]) for entry in entries]
         else:
-            existing_data = result
-            if data and isinstance(data, list) and len(data) > 0:
-                fieldnames = list(data[0].keys())
-            else:
-                fieldnames = []
-
-        output = io.StringIO()
-        if fieldnames:
-            writer = csv.DictWriter(output, fieldnames=fieldnames)
-            writer.writeheader()
-            if existing_data:
-                writer.writerows(existing_data)
-            if data:
-                writer.writerows(data)
-            data = output.getvalue()
+            objects = [(entry["rows"], entry["size"]) for entry in entries]
+        policy.observe(dataset, batch["generated"][driver], objects)
 
-    try:
-        s3_client.put_object(Bucket=bucket_name, Key=file_path, Body=data)
-        print(f"Datos subidos a S3: {file_path}")
-    except Exception as e:
-        print(f"Error al subir {file_path} a S3: {e}")
+def generate_with_retries(seq, resume_time=None):
+    """Genera el lote `seq`, reintentando el mismo lote si falla.
+
+    Ninguna secuencia se salta: el lote siguiente solo se genera cuando este
+    quedó listo, con o sin generación por adelantado.
+    """
+    while True:
+        try:
+            return generate_batch(seq, resume_time)
+        except Exception as e:
+            print(f"Error al generar el lote {seq}: {e}; reintento en {retry_interval} segundos...")
+            time.sleep(retry_interval)
+
+def produce_batches(batches, first_seq, resume_time=None):
+    """Genera lotes por adelantado mientras se sube el anterior; la cola acotada frena al productor."""
+    for seq in count(first_seq):
+        batches.put(generate_with_retries(seq, resume_time if seq == first_seq else None))
+
+def load_run_state():
+    """Carga el checkpoint y retorna la secuencia y la marca de tiempo con que se reanuda."""
+    checkpoint_state.update(load_checkpoint())
+    run_id = os.environ.get("RUN_ID") or checkpoint_state.get("run_id") or uuid.uuid4().hex
+    if checkpoint_state.get("run_id") != run_id:
+        checkpoint_state.clear()
+        checkpoint_state.update({"run_id": run_id, "last_committed": 0})
+    first_seq = checkpoint_state.get("last_committed", 0) + 1
+    pending = checkpoint_state.get("pending")
+    resume_time = None
+    if pending and pending["seq"] == first_seq:
+        resume_time = datetime.fromisoformat(pending["batch_time"])
+    return first_seq, resume_time
+
+def stamp_batch(batch):
+    """Asigna la marca de tiempo del lote (particiones y claves) al momento de subirlo, salvo que se reanude."""
+    if batch["batch_time"] is None:
+        batch["batch_time"] = datetime.utcnow()
+    return batch
+
+def mark_batch(batch, committed):
+    """Registra en el checkpoint el lote en curso o, si se confirmó, el último lote confirmado."""
+    if committed:
+        checkpoint_state["last_committed"] = batch["seq"]
+        checkpoint_state.pop("pending", None)
+    else:
+        checkpoint_state["pending"] = {"seq": batch["seq"], "batch_time": batch["batch_time"].isoformat()}
+    save_checkpoint(checkpoint_state)
 
 def main():
     print("Iniciando generación continua de datos...")
+
+    if skip_unchanged:
+        try:
+            published_digests.update(load_digests(storage))
+        except Exception as e:
+            print(f"Error al leer los digests publicados: {e}")
+
+    # Subida desacoplada: un hilo drena el spool, incluidos los lotes de una ejecución anterior
+    if spool is not None:
+        threading.Thread(target=drain_forever, args=(spool, run_spooled), daemon=True).start()
+
+    # Reanudar en el lote siguiente al último confirmado
+    first_seq, resume_time = load_run_state()
+    print(f"Ejecución {checkpoint_state['run_id']}: comenzando en el lote {first_seq}")
+
+    # Doble búfer: el lote N+1 se genera mientras el lote N se sube o se espera
+    if prefetch_batches > 0:
+        batches = queue.Queue(maxsize=prefetch_batches)
+        threading.Thread(target=produce_batches, args=(batches, first_seq, resume_time), daemon=True).start()
+        next_batch = batches.get
+    else:
+        sequence = count(first_seq)
+
+        def next_batch():
+            seq = next(sequence)
+            return generate_with_retries(seq, resume_time if seq == first_seq else None)
+
     while True:
-        # Limpiar transacciones compartidas antes de cada iteración
-        shared_transactions.clear()
+        cycle_start = time.monotonic()
+        batch = stamp_batch(next_batch())
+        mark_batch(batch, committed=False)
+
+        # Subir datos a S3 en paralelo y reportar los errores al final del ciclo;
+        # los datasets con error se reintentan con las mismas claves antes de
+        # confirmar el lote
+        added = {}
+        pending = batch["datasets"]
+        while pending:
+            uploaded, errors = upload_batch(pending, batch["batch_id"], batch["batch_time"], batch["digests"])
+            added.update(uploaded)
+            for dataset, error in errors.items():
+                print(f"Error al subir {dataset} a S3: {error}")
+            pending = {dataset: pending[dataset] for dataset in errors}
+            observe_written(batch, uploaded)
+            if pending:
+                print(f"Reintentando {', '.join(pending)} en {retry_interval} segundos...")
+                time.sleep(retry_interval)
 
-        # Generar y acumular datos
-        customers = [generate_customer_data() for _ in range(200)]
+        # Publicar los archivos del lote en el manifiesto (con spool, después de sus subidas)
+        while use_manifest and added:
+            try:
+                publish(spool, run_spooled, [], operation="commit", batch_id=batch["batch_id"], added=added)
+                break
+            except Exception as e:
+                print(f"Error al confirmar el lote en el manifiesto: {e}; reintento en {retry_interval} segundos...")
+                time.sleep(retry_interval)
+        mark_batch(batch, committed=True)
 
-        # Subir datos a S3
-        upload_to_s3(customers, file_paths["customers"], "json")
-        upload_to_s3(shared_transactions, file_paths["transactions"], "csv")
-        upload_to_s3(generate_providers_data(), file_paths["providers"], "csv")
-        upload_to_s3(generate_products_data(), file_paths["products"], "json")  # Cambiado a JSON
-        upload_to_s3(generate_invoices_data(), file_paths["invoices"], "json")  # Cambiado a JSON
+        # Métricas de E/S del ciclo, con los reintentos y throttles de S3
+        s3_metrics = scheduler.drain_metrics()
+        scheduler.report(s3_metrics)
+        io_metrics.add_retries(s3_metrics)
+        io_metrics.emit(cycle=batch["seq"], batch_id=batch["batch_id"], seconds=round(time.monotonic() - cycle_start, 3))
 
-        print(f"Datos generados y subidos. Esperando 12 minutos...")
-        time.sleep(12 * 60)
+        remaining = max(0, cycle_interval - (time.monotonic() - cycle_start))
+        print(f"Datos generados y subidos. Esperando {remaining:.0f} segundos...")
+        time.sleep(remaining)
 
 if __name__ == "__main__":
     main()
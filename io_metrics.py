@@ -0,0 +1,262 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from storage import ObjectNotFound, S3Storage, min_part_size, max_copy_part_size
+from streaming_upload import transfer_config
+
+# Línea JSON con las métricas de E/S al final de cada ciclo y, opcionalmente,
+# el mismo contenido en CloudWatch Embedded Metric Format (EMF) por stdout
+emit_json = os.environ.get("IO_METRICS", "true").lower() == "true"
+emit_emf = os.environ.get("IO_METRICS_EMF", "false").lower() == "true"
+emf_namespace = os.environ.get("IO_METRICS_NAMESPACE", "DataLakeSimulacion")
+
+# Carpetas de la ruta legacy (data/<formato>/<dataset>.<ext>)
+format_folders = ("json", "csv", "parquet")
+
+# Métricas por dataset y su unidad en EMF
+metric_units = {
+    "requests": "Count",
+    "gets": "Count",
+    "puts": "Count",
+    "lists": "Count",
+    "heads": "Count",
+    "deletes": "Count",
+    "bytes_read": "Bytes",
+    "bytes_written": "Bytes",
+    "latency_ms": "Milliseconds",
+    "max_latency_ms": "Milliseconds",
+    "errors": "Count",
+    "retries": "Count",
+    "throttles": "Count",
+    "retry_seconds": "Seconds",
+}
+
+def dataset_of(key):
+    """Dataset al que pertenece una clave (sin el prefijo de shard ni _stats/).
+
+    Las claves del manifiesto y del estado (data/_manifest, data/_state) se
+    agrupan bajo su carpeta.
+    """
+    parts = key.split("/")
+    if parts[0] not in ("data", "_stats") and len(parts) > 1:
+        parts = parts[1:]
+    if parts[0] == "_stats":
+        return dataset_of("/".join(parts[1:]))
+    if parts[0] != "data" or len(parts) < 2:
+        return parts[0] or "/"
+    if parts[1] in format_folders and len(parts) > 2 and parts[2]:
+        return parts[2].split(".")[0]
+    return parts[1]
+
+def empty_metrics():
+    return {name: 0 for name in metric_units}
+
+class IOMetrics:
+    """Acumula solicitudes, bytes y latencia de las operaciones de almacenamiento por dataset."""
+
+    def __init__(self):
+        self.metrics = defaultdict(empty_metrics)
+        self.lock = threading.Lock()
+
+    def record(self, key, operation, seconds, bytes_read=0, bytes_written=0, requests=1, failed=False):
+        latency_ms = seconds * 1000
+        with self.lock:
+            metrics = self.metrics[dataset_of(key)]
+            metrics["requests"] += requests
+            metrics[operation] += requests
+            metrics["bytes_read"] += bytes_read
+            metrics["bytes_written"] += bytes_written
+            metrics["latency_ms"] += latency_ms
+            metrics["max_latency_ms"] = max(metrics["max_latency_ms"], latency_ms)
+            metrics["errors"] += int(failed)
+
+    def add_retries(self, s3_metrics):
+        """Suma los reintentos y throttles del planificador de S3 (por prefijo) a su dataset.
+
+        En el modo legacy el prefijo es la carpeta del formato (data/json), que
+        agrupa a varios datasets.
+        """
+        with self.lock:
+            for prefix, values in s3_metrics.items():
+                if not (values["retries"] or values["throttles"]):
+                    continue
+                metrics = self.metrics[dataset_of(prefix + "/")]
+                for name in ("retries", "throttles", "retry_seconds"):
+                    metrics[name] += values[name]
+
+    def drain(self):
+        """Retorna las métricas acumuladas por dataset y las reinicia."""
+        with self.lock:
+            metrics = {
+                dataset: {name: round(value, 3) for name, value in values.items()}
+                for dataset, values in self.metrics.items()
+            }
+            self.metrics.clear()
+        return metrics
+
+    def emit(self, **fields):
+        """Imprime las métricas del ciclo (JSON y/o EMF) y las reinicia; `fields` identifica el ciclo."""
+        datasets = self.drain()
+        totals = empty_metrics()
+        for metrics in datasets.values():
+            for name, value in metrics.items():
+                totals[name] = max(totals[name], value) if name == "max_latency_ms" else totals[name] + value
+        if emit_json:
+            print(json.dumps({"event": "io_metrics", **fields, "totals": totals, "datasets": datasets}, default=str))
+        if emit_emf:
+            for dataset, metrics in sorted(datasets.items()):
+                print(json.dumps(emf_record(dataset, metrics, fields), default=str))
+        return datasets
+
+def emf_record(dataset, metrics, fields):
+    """Registro en CloudWatch Embedded Metric Format con la dimensión Dataset."""
+    return {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": emf_namespace,
+                "Dimensions": [["Dataset"]],
+                "Metrics": [{"Name": name, "Unit": unit} for name, unit in metric_units.items()],
+            }],
+        },
+        "Dataset": dataset,
+        **fields,
+        **metrics,
+    }
+
+class MeteredStream:
+    """Flujo de lectura que registra los bytes leídos al cerrarse."""
+
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        if self._on_close:
+            self._on_close(self.bytes_read)
+            self._on_close = None
+        self._stream.close()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+class MeteredStorage:
+    """Envuelve un backend de storage.py y registra cada operación en `metrics`.
+
+    Las listas y los borrados cuentan una solicitud por cada 1000 claves,
+    como las páginas de ListObjectsV2 y los lotes de DeleteObjects en S3, y
+    una subida multiparte cuenta sus partes más el inicio y el cierre.
+    """
+
+    def __init__(self, storage, metrics):
+        self.storage = storage
+        self.metrics = metrics
+
+    def call(self, key, operation, function, *args, measure=None, **kwargs):
+        start = time.monotonic()
+        try:
+            result = function(*args, **kwargs)
+        except ObjectNotFound:
+            self.metrics.record(key, operation, time.monotonic() - start)
+            raise
+        except Exception:
+            self.metrics.record(key, operation, time.monotonic() - start, failed=True)
+            raise
+        self.metrics.record(key, operation, time.monotonic() - start, **(measure(result) if measure else {}))
+        return result
+
+    def get_requests(self, size):
+        """GETs de una descarga: los objetos grandes de S3 se piden en partes."""
+        if not isinstance(self.storage, S3Storage) or size <= self.storage.part_size:
+            return 1
+        return -(-size // self.storage.part_size)
+
+    def get_with_etag(self, key):
+        return self.call(key, "gets", self.storage.get_with_etag, key, measure=lambda result: self.download_measure(result[0]))
+
+    def get(self, key):
+        return self.call(key, "gets", self.storage.get, key, measure=self.download_measure)
+
+    def get_if_changed(self, key, etag):
+        return self.call(
+            key, "gets", self.storage.get_if_changed, key, etag,
+            measure=lambda result: self.download_measure(result[0]) if result else {},
+        )
+
+    def download_measure(self, body):
+        return {"bytes_read": len(body), "requests": self.get_requests(len(body))}
+
+    def get_range(self, key, start, end):
+        return self.call(key, "gets", self.storage.get_range, key, start, end, measure=lambda body: {"bytes_read": len(body)})
+
+    def open(self, key):
+        stream = self.call(key, "gets", self.storage.open, key)
+        return self.metered_stream(key, stream)
+
+    def open_if_changed(self, key, etag):
+        result = self.call(key, "gets", self.storage.open_if_changed, key, etag)
+        return result and (self.metered_stream(key, result[0]), result[1])
+
+    def metered_stream(self, key, stream):
+        return MeteredStream(stream, lambda size: self.metrics.record(key, "gets", 0, bytes_read=size, requests=0))
+
+    def put(self, key, body, if_none_match=False, if_match=None):
+        size = len(body.encode("utf-8") if isinstance(body, str) else body)
+        return self.call(key, "puts", self.storage.put, key, body, if_none_match, if_match, measure=lambda _: {"bytes_written": size})
+
+    def put_requests(self, size, config):
+        config = config or transfer_config
+        if not isinstance(self.storage, S3Storage) or size < config.multipart_threshold:
+            return 1
+        return -(-size // config.multipart_chunksize) + 2
+
+    def put_chunks(self, key, chunks, extra_args=None, config=None):
+        return self.call(
+            key, "puts", self.storage.put_chunks, key, chunks, extra_args, config,
+            measure=lambda size: {"bytes_written": size, "requests": self.put_requests(size, config)},
+        )
+
+    def append_requests(self, size):
+        if not isinstance(self.storage, S3Storage):
+            return 1
+        if size < min_part_size:
+            return 2
+        return -(-size // max_copy_part_size) + 3
+
+    def append(self, key, body, size, etag, extra_args=None):
+        requests = self.append_requests(size)
+        return self.call(
+            key, "puts", self.storage.append, key, body, size, etag, extra_args,
+            measure=lambda _: {"bytes_written": len(body), "requests": requests},
+        )
+
+    def head(self, key):
+        return self.call(key, "heads", self.storage.head, key)
+
+    def size(self, key):
+        return self.call(key, "heads", self.storage.size, key)
+
+    def list(self, prefix):
+        return self.call(prefix, "lists", self.storage.list, prefix, measure=lambda keys: {"requests": len(keys) // 1000 + 1})
+
+    def delete(self, keys):
+        for dataset_keys in group_by_dataset(keys).values():
+            requests = (len(dataset_keys) + 999) // 1000
+            self.call(dataset_keys[0], "deletes", self.storage.delete, dataset_keys, measure=lambda _: {"requests": requests})
+
+def group_by_dataset(keys):
+    groups = defaultdict(list)
+    for key in keys:
+        groups[dataset_of(key)].append(key)
+    return groups
+
+# Métricas compartidas por todo el proceso
+io_metrics = IOMetrics()
@@ -0,0 +1,122 @@
+import codecs
+import json
+import re
+from contextlib import closing
+from compression import detect_compression, open_decompressed
+
+# Bytes que se leen del objeto en cada paso
+read_size = 1024 * 1024
+
+whitespace = re.compile(r"[ \t\n\r]*")
+
+# Caracteres que pueden seguir a un elemento del arreglo
+delimiters = " \t\n\r,]"
+
+def iter_stream_chunks(stream, size=read_size):
+    """Lee un flujo binario en bloques de `size` bytes."""
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+def iter_text(chunks, encoding="utf-8"):
+    """Decodifica bloques de bytes sin cortar caracteres multibyte entre bloques."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+def iter_lines(chunks, encoding="utf-8"):
+    """Entrega las líneas (con su salto de línea) de un flujo de bloques de bytes."""
+    pending = ""
+    for text in iter_text(chunks, encoding):
+        lines = (pending + text).splitlines(keepends=True)
+        pending = "" if lines[-1].endswith(("\n", "\r")) else lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+class TextBuffer:
+    """Ventana de texto sobre un flujo; solo conserva lo que aún no se consumió."""
+
+    def __init__(self, texts):
+        self.texts = iter(texts)
+        self.text = ""
+        self.pos = 0
+
+    def fill(self):
+        """Agrega el siguiente bloque descartando lo consumido; False al terminar."""
+        try:
+            chunk = next(self.texts)
+        except StopIteration:
+            return False
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Siguiente carácter que no es espacio ("" al final del flujo)."""
+        while True:
+            self.pos = whitespace.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ""
+
+    def decode(self, decoder):
+        """Decodifica el siguiente valor JSON, leyendo más texto si quedó cortado."""
+        if not self.peek():
+            raise ValueError("Arreglo JSON incompleto")
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # Un número cortado por el bloque ("2." de "2.5") se decodifica igual:
+            # solo se acepta el valor si lo sigue un delimitador o el fin del flujo
+            if (end < len(self.text) and self.text[end] in delimiters) or not self.fill():
+                self.pos = end
+                return value
+
+def iter_json_array(chunks, encoding="utf-8"):
+    """Entrega uno a uno los elementos de un arreglo JSON sin cargarlo completo en memoria."""
+    decoder = json.JSONDecoder()
+    buffer = TextBuffer(iter_text(chunks, encoding))
+    if buffer.peek() != "[":
+        raise ValueError("Se esperaba un arreglo JSON")
+    buffer.pos += 1
+    if buffer.peek() == "]":
+        return
+    while True:
+        yield buffer.decode(decoder)
+        char = buffer.peek()
+        if char == "]":
+            return
+        if char != ",":
+            raise ValueError(f"Se esperaba ',' o ']' y se encontró {char!r}")
+        buffer.pos += 1
+
+def iter_json_stream(stream, compression=None, size=read_size):
+    """Elementos del arreglo JSON de un flujo binario, leído en bloques de `size` bytes.
+
+    El flujo se descomprime en streaming con `compression` y se cierra al
+    terminar; en memoria queda solo el bloque en curso.
+    """
+    with closing(stream):
+        yield from iter_json_array(iter_stream_chunks(open_decompressed(stream, compression), size))
+
+def open_json_array(storage, key, size=read_size):
+    """Abre un objeto con un arreglo JSON y retorna un iterador de sus elementos.
+
+    Los primeros registros están disponibles tras leer el primer bloque. El
+    objeto se abre de inmediato, de modo que ObjectNotFound se lanza aquí y
+    no al iterar; el códec se deduce de la extensión de la clave.
+    """
+    return iter_json_stream(storage.open(key), detect_compression(key), size)
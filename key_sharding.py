@@ -0,0 +1,46 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Número de prefijos hash entre los que se reparten las escrituras (0 = desactivado)
+shard_count = int(os.environ.get("KEY_SHARDS", "0"))
+
+def shard_width(shards):
+    """Cantidad de dígitos hexadecimales necesarios para numerar los shards."""
+    return len(format(max(shards - 1, 0), "x"))
+
+def shard_prefix(batch_id, shards=shard_count):
+    """Prefijo hexadecimal corto derivado del identificador de lote."""
+    digest = int(hashlib.md5(batch_id.encode("utf-8")).hexdigest(), 16)
+    return format(digest % shards, f"0{shard_width(shards)}x")
+
+def sharded_key(key, batch_id, shards=shard_count):
+    """Antepone el prefijo hash del lote a la clave; sin shards la retorna igual."""
+    if shards <= 0:
+        return key
+    return f"{shard_prefix(batch_id, shards)}/{key}"
+
+def sharded_run_key(key, run_id, shards=shard_count):
+    """Clave por ejecución para los generadores que escriben un archivo fijo.
+
+    Agrega el identificador antes de la extensión para que escritores
+    paralelos no se pisen dentro del mismo shard.
+    """
+    if shards <= 0:
+        return key
+    folder, _, filename = key.rpartition("/")
+    name, dot, extension = filename.partition(".")
+    return sharded_key(f"{folder}/{name}-{run_id}{dot}{extension}", run_id, shards)
+
+def shard_prefixes(prefix, shards=shard_count):
+    """Retorna el prefijo del dataset dentro de cada shard."""
+    if shards <= 0:
+        return [prefix]
+    width = shard_width(shards)
+    return [f"{shard:0{width}x}/{prefix}" for shard in range(shards)]
+
+def list_shard_keys(storage, prefix, shards=shard_count, max_workers=8):
+    """Enumera las claves de un dataset en todos sus shards, listándolos en paralelo."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        listings = executor.map(storage.list, shard_prefixes(prefix, shards))
+        return sorted(key for keys in listings for key in keys)
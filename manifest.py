@@ -0,0 +1,269 @@
+import copy
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from storage import ObjectNotFound, PreconditionFailed
+
+# Puntero al último snapshot consistente: por dataset, su versión, el último
+# checkpoint y las versiones del log publicadas desde ese checkpoint
+latest_key = "data/_manifest/_latest.json"
+
+# Cada cuántas versiones publicadas de un dataset se escribe un checkpoint
+checkpoint_interval = int(os.environ.get("MANIFEST_CHECKPOINT_INTERVAL", "10"))
+
+# Lecturas concurrentes al cargar un snapshot. Costo de load_snapshot: 1 GET
+# del puntero y, por dataset, 1 GET del checkpoint más hasta
+# checkpoint_interval - 1 GETs de versiones del log. Los GETs de todos los
+# datasets se emiten en paralelo, así que la latencia es la del puntero más
+# aproximadamente una ronda de GETs (varias si superan este límite); con
+# MANIFEST_CHECKPOINT_INTERVAL=1 cada dataset se lee con un único GET.
+read_concurrency = int(os.environ.get("MANIFEST_READ_CONCURRENCY", "16"))
+
+def log_key(dataset, version):
+    """Clave de una versión del log de transacciones (estilo Delta) de un dataset."""
+    return f"data/{dataset}/_delta_log/{version:020d}.json"
+
+def checkpoint_key(dataset, version):
+    """Clave del checkpoint con los archivos vigentes de un dataset en una versión."""
+    return f"data/{dataset}/_delta_log/{version:020d}.checkpoint.json"
+
+def commit_key(batch_id):
+    """Clave del registro de commit de un ciclo."""
+    return f"data/_manifest/commits/{batch_id}.json"
+
+def empty_snapshot():
+    return {"batch_id": None, "timestamp": None, "versions": {}, "metadata": {}, "checkpoints": {}, "log": {}, "files": {}}
+
+def read_log_version(storage, dataset, version):
+    """Acciones de una versión del log."""
+    return [json.loads(line) for line in storage.get(log_key(dataset, version)).decode("utf-8").splitlines() if line]
+
+def apply_actions(files, actions):
+    """Aplica las acciones add/remove a {ruta: entrada}; un add en una ruta existente la reemplaza."""
+    for action in actions:
+        if "remove" in action:
+            files.pop(action["remove"]["path"], None)
+        elif "add" in action:
+            files.pop(action["add"]["path"], None)
+            files[action["add"]["path"]] = action["add"]
+
+def read_checkpoint(storage, checkpoint):
+    """Entradas {ruta: entrada} de un checkpoint."""
+    return {entry["path"]: entry for entry in json.loads(storage.get(checkpoint["path"]).decode("utf-8"))["files"]}
+
+def request_dataset_files(storage, snapshot, dataset, executor):
+    """Pide en paralelo el checkpoint y las versiones del log de un dataset; retorna una función que arma sus entradas."""
+    checkpoint = snapshot["checkpoints"].get(dataset)
+    pending_checkpoint = executor.submit(read_checkpoint, storage, checkpoint) if checkpoint else None
+    pending_versions = [executor.submit(read_log_version, storage, dataset, version)
+                        for version in snapshot["log"].get(dataset, [])]
+
+    def assemble():
+        # Las acciones se aplican en orden de versión, no de llegada
+        files = pending_checkpoint.result() if pending_checkpoint else {}
+        for pending in pending_versions:
+            apply_actions(files, pending.result())
+        snapshot["files"][dataset] = list(files.values())
+        return snapshot["files"][dataset]
+    return assemble
+
+def dataset_files(storage, snapshot, dataset):
+    """Entradas vigentes de un dataset: su checkpoint más las versiones del log publicadas después."""
+    if dataset in snapshot["files"]:
+        return snapshot["files"][dataset]
+    with ThreadPoolExecutor(max_workers=read_concurrency) as executor:
+        return request_dataset_files(storage, snapshot, dataset, executor)()
+
+def load_snapshot(storage, key=latest_key, datasets=None):
+    """Lee el último snapshot publicado; si no existe retorna uno vacío.
+
+    El puntero no trae los archivos: los de `datasets` (por defecto, todos)
+    se leen de sus checkpoints y logs (en paralelo, ver read_concurrency) y
+    quedan en snapshot["files"]; con una lista vacía solo se lee el puntero.
+    El ETag leído se guarda en el snapshot para reemplazarlo de forma
+    condicional.
+    """
+    try:
+        body, etag = storage.get_with_etag(key)
+    except ObjectNotFound:
+        return empty_snapshot()
+    snapshot = json.loads(body.decode("utf-8"))
+    # Un puntero anterior a los checkpoints trae la lista completa de archivos
+    snapshot.setdefault("files", {})
+    snapshot.setdefault("checkpoints", {})
+    snapshot.setdefault("log", {})
+    snapshot["etag"] = etag
+    datasets = [dataset for dataset in (snapshot["versions"] if datasets is None else datasets)
+                if dataset not in snapshot["files"]]
+    if datasets:
+        # Se piden los GETs de todos los datasets antes de esperar ninguno
+        with ThreadPoolExecutor(max_workers=read_concurrency) as executor:
+            for assemble in [request_dataset_files(storage, snapshot, dataset, executor) for dataset in datasets]:
+                assemble()
+    return snapshot
+
+def loaded_files(snapshot, dataset):
+    """Entradas de un dataset ya leídas por load_snapshot."""
+    if dataset in snapshot["versions"] and dataset not in snapshot["files"]:
+        raise ValueError(f"Los archivos de {dataset} no se leyeron del snapshot")
+    return snapshot["files"].get(dataset, [])
+
+def snapshot_files(snapshot, dataset):
+    """Rutas de los archivos vigentes de un dataset en el snapshot."""
+    return [entry["path"] for entry in loaded_files(snapshot, dataset)]
+
+def files_in_range(snapshot, dataset, column, low=None, high=None):
+    """Entradas vigentes cuyo rango min/max de `column` se cruza con [low, high].
+
+    Los archivos sin estadísticas de la columna se conservan siempre.
+    """
+    selected = []
+    for entry in loaded_files(snapshot, dataset):
+        stats = entry.get("stats") or {}
+        minimum = stats.get("minValues", {}).get(column)
+        maximum = stats.get("maxValues", {}).get(column)
+        if minimum is None or maximum is None:
+            selected.append(entry)
+        elif (high is None or minimum <= high) and (low is None or maximum >= low):
+            selected.append(entry)
+    return selected
+
+def files_in_partition(snapshot, dataset, values):
+    """Entradas vigentes de una partición Hive, p. ej. {"region": "Chile"}."""
+    return [
+        entry for entry in loaded_files(snapshot, dataset)
+        if all(entry.get("partitionValues", {}).get(column) == value for column, value in values.items())
+    ]
+
+def bucket_files(snapshot, datasets):
+    """Agrupa por bucket los archivos vigentes de datasets con el mismo bucketing.
+
+    Retorna {bucket: {dataset: [entradas]}}: cada bucket se puede unir por
+    separado (y en paralelo) leyendo solo sus archivos.
+    """
+    layouts = {
+        (tuple(snapshot["metadata"].get(dataset, {}).get("bucketColumns", [])), snapshot["metadata"].get(dataset, {}).get("numBuckets"))
+        for dataset in datasets
+    }
+    if len(layouts) != 1 or not next(iter(layouts))[1]:
+        raise ValueError(f"Los datasets {', '.join(datasets)} no comparten el mismo bucketing")
+    buckets = {bucket: {dataset: [] for dataset in datasets} for bucket in range(next(iter(layouts))[1])}
+    for dataset in datasets:
+        for entry in loaded_files(snapshot, dataset):
+            if entry.get("bucket") is None:
+                raise ValueError(f"{entry['path']} se escribió sin buckets")
+            buckets[entry["bucket"]][dataset].append(entry)
+    return buckets
+
+def fill_sizes(storage, entries):
+    """Completa el tamaño de los archivos que no lo traen (p. ej. subidos desde el spool)."""
+    for entry in entries:
+        if entry.get("size") is None:
+            entry["size"] = storage.size(entry["path"])
+
+def write_log_version(storage, dataset, version, actions, batch_id):
+    """Escribe la primera versión libre del log desde `version` y retorna su número.
+
+    Una versión que ya existe y pertenece al mismo lote (un commit que quedó a
+    medias) se reutiliza. Las de otros lotes no las referencia _latest.json
+    (son de un escritor que perdió la carrera o de uno en curso) y se saltan
+    sin pisarlas: el snapshot publicado indica qué versión vale.
+    """
+    while True:
+        key = log_key(dataset, version)
+        try:
+            storage.put(key, "\n".join(json.dumps(action) for action in actions), if_none_match=True)
+            return version
+        except PreconditionFailed:
+            existing = storage.get(key).decode("utf-8")
+            commit_info = json.loads(existing.splitlines()[-1]).get("commitInfo", {})
+            if commit_info.get("batch_id") == batch_id:
+                return version
+            print(f"{key} es del lote {commit_info.get('batch_id')}, que no está publicado; se usa la versión siguiente")
+            version += 1
+
+def listed_in_pointer(snapshot, dataset):
+    """Indica si el dataset viene de un puntero anterior a los checkpoints (sin checkpoint ni log)."""
+    return dataset in snapshot["versions"] and dataset not in snapshot["checkpoints"] and not snapshot["log"].get(dataset)
+
+def write_checkpoint(storage, snapshot, dataset, version, actions):
+    """Escribe el checkpoint de un dataset en `version`: los archivos vigentes tras aplicar `actions`."""
+    files = {entry["path"]: entry for entry in dataset_files(storage, snapshot, dataset)}
+    apply_actions(files, actions)
+    key = checkpoint_key(dataset, version)
+    storage.put(key, json.dumps({"version": version, "files": list(files.values())}))
+    return {"version": version, "path": key}
+
+def commit_cycle(storage, snapshot, batch_id, added, removed=None, metadata=None, operation="WRITE"):
+    """Publica de forma atómica los archivos de un ciclo y retorna el nuevo snapshot.
+
+    Se escribe primero una versión nueva del log de cada dataset afectado
+    (con If-None-Match para no pisar la versión de otro escritor), luego el
+    registro de commit del ciclo y por último el puntero _latest.json. Hasta
+    ese último PUT los lectores siguen viendo el snapshot anterior completo.
+    El puntero se reemplaza solo si no cambió desde que se leyó; si otro
+    escritor confirmó antes se lanza PreconditionFailed y el llamador vuelve
+    a leer el snapshot y reintenta (las versiones ya escritas se reutilizan).
+    Las versiones de lotes que nunca se publicaron se saltan.
+    Confirmar otra vez el último lote publicado no tiene efecto.
+
+    Cada ciclo solo agrega sus acciones al log; cada `checkpoint_interval`
+    versiones de un dataset se escribe un checkpoint con sus archivos
+    vigentes, de modo que el puntero no crece con el número de archivos.
+
+    `added` es {dataset: [entradas]}, `removed` es {dataset: [rutas]} y
+    `metadata` es {dataset: {propiedades de la tabla}}.
+    """
+    if snapshot.get("batch_id") == batch_id:
+        return snapshot
+    removed = removed or {}
+    metadata = metadata or {}
+    timestamp = datetime.now(timezone.utc).isoformat()
+    new_snapshot = copy.deepcopy(snapshot)
+    etag = new_snapshot.pop("etag", None)
+    versions = {}
+
+    for dataset in sorted(set(added) | set(removed) | set(metadata)):
+        entries = added.get(dataset, [])
+        fill_sizes(storage, entries)
+        version = snapshot["versions"].get(dataset, -1) + 1
+
+        actions = []
+        if dataset in metadata:
+            actions.append({"metaData": metadata[dataset]})
+        actions.extend({"remove": {"path": path, "deletionTimestamp": timestamp}} for path in removed.get(dataset, []))
+        actions.extend({"add": entry} for entry in entries)
+        actions.append({"commitInfo": {"batch_id": batch_id, "timestamp": timestamp, "operation": operation}})
+        version = write_log_version(storage, dataset, version, actions, batch_id)
+        versions[dataset] = version
+
+        log = new_snapshot["log"].get(dataset, []) + [version]
+        if len(log) >= checkpoint_interval or listed_in_pointer(snapshot, dataset):
+            new_snapshot["checkpoints"][dataset] = write_checkpoint(storage, new_snapshot, dataset, version, actions)
+            log = []
+        new_snapshot["log"][dataset] = log
+        if dataset in new_snapshot["files"]:
+            files = {entry["path"]: entry for entry in new_snapshot["files"][dataset]}
+            apply_actions(files, actions)
+            new_snapshot["files"][dataset] = list(files.values())
+        if dataset in metadata:
+            new_snapshot.setdefault("metadata", {})[dataset] = metadata[dataset]
+
+    # Los datasets de un puntero anterior a los checkpoints se pasan a un
+    # checkpoint en su versión actual, con la lista completa que traía
+    for dataset, version in snapshot["versions"].items():
+        if dataset not in versions and listed_in_pointer(snapshot, dataset):
+            new_snapshot["checkpoints"][dataset] = write_checkpoint(storage, new_snapshot, dataset, version, [])
+
+    new_snapshot["versions"].update(versions)
+    new_snapshot["batch_id"] = batch_id
+    new_snapshot["timestamp"] = timestamp
+
+    commit = {"batch_id": batch_id, "timestamp": timestamp, "versions": versions, "added": added, "removed": removed}
+    storage.put(commit_key(batch_id), json.dumps(commit, indent=4))
+    pointer = {name: value for name, value in new_snapshot.items() if name != "files"}
+    new_snapshot["etag"] = storage.put(
+        latest_key, json.dumps(pointer, indent=4), if_none_match=etag is None, if_match=etag,
+    )
+    return new_snapshot
@@ -0,0 +1,191 @@
+import argparse
+import csv
+import os
+import resource
+import sys
+import time
+import uuid
+from collections import defaultdict
+from contextlib import closing
+from itertools import count
+from settings import dataset_options
+from compression import detect_compression, open_decompressed
+from json_stream import iter_stream_chunks, iter_json_array, iter_lines
+from key_sharding import sharded_key
+from manifest import load_snapshot, commit_cycle, commit_key, snapshot_files
+from parquet_writer import iter_parquet_chunks
+from storage import create_storage, LocalStorage, ObjectNotFound, PreconditionFailed
+
+# Objetos monolíticos del modo legacy (p. ej. MIGRATION_SOURCES="customers=data/json/customers.json.gz")
+sources = dataset_options("MIGRATION_SOURCES", {
+    "customers": "data/json/customers.json",
+    "invoices": "data/json/invoices.json",
+    "transactions": "data/csv/transactions.csv",
+})
+
+# Filas por archivo Parquet y filas retenidas en memoria entre todas las particiones
+rows_per_file = int(os.environ.get("MIGRATION_FILE_ROWS", "100000"))
+max_buffered_rows = int(os.environ.get("MIGRATION_BUFFER_ROWS", "50000"))
+
+# Cada cuántas filas se informa el avance
+report_every = 100000
+
+# Partición de los registros sin fecha (convención de Hive)
+default_partition = "__HIVE_DEFAULT_PARTITION__"
+
+def first_purchase_date(customer):
+    """Fecha de la primera compra del cliente, o None si no tiene compras."""
+    dates = [purchase.get("purchase_date") for purchase in customer.get("purchase_history") or []]
+    dates = [date for date in dates if date]
+    return min(dates) if dates else None
+
+# Fecha que define la partición de cada dataset
+partition_dates = {
+    "customers": first_purchase_date,
+    "invoices": lambda invoice: invoice.get("invoice_date"),
+    "transactions": lambda transaction: transaction.get("purchase_date"),
+}
+
+def partition_of(record, dataset):
+    """Partición dt=YYYY-MM-DD del registro."""
+    date = partition_dates[dataset](record)
+    return date[:10] if date else default_partition
+
+def peak_rss_mb():
+    """Memoria residente máxima del proceso en MiB (ru_maxrss está en KiB en Linux y en bytes en macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def report(dataset, rows, start):
+    elapsed = max(time.monotonic() - start, 1e-9)
+    print(f"{dataset}: {rows} filas, {rows / elapsed:.0f} filas/s, RSS máximo {peak_rss_mb():.0f} MiB")
+
+def open_source(storage, key):
+    """Abre el objeto legacy como flujo binario, descomprimiéndolo en streaming si corresponde."""
+    return open_decompressed(storage.open(key), detect_compression(key))
+
+def iter_source_records(stream, key):
+    """Registros del objeto: arreglo JSON leído incrementalmente o CSV por líneas."""
+    chunks = iter_stream_chunks(stream)
+    if ".csv" in key.rsplit("/", 1)[-1]:
+        return csv.DictReader(iter_lines(chunks))
+    return iter_json_array(chunks)
+
+class PartitionedWriter:
+    """Reparte registros en archivos Parquet por partición con memoria acotada.
+
+    Cada partición acumula filas hasta `rows_per_file`; si el total retenido
+    supera `max_buffered_rows` se vuelca la partición más grande. Una fecha
+    puede terminar en varios archivos, que luego puede unir la compactación.
+    """
+
+    def __init__(self, storage, dataset, migration_id, rows_per_file=rows_per_file, max_buffered_rows=max_buffered_rows):
+        self.storage = storage
+        self.dataset = dataset
+        self.migration_id = migration_id
+        self.rows_per_file = rows_per_file
+        self.max_buffered_rows = max_buffered_rows
+        self.buffers = defaultdict(list)
+        self.buffered = 0
+        self.parts = count()
+        self.entries = []
+
+    def add(self, partition, record):
+        buffer = self.buffers[partition]
+        buffer.append(record)
+        self.buffered += 1
+        if len(buffer) >= self.rows_per_file:
+            self.flush(partition)
+        elif self.buffered >= self.max_buffered_rows:
+            self.flush(max(self.buffers, key=lambda name: len(self.buffers[name])))
+
+    def flush(self, partition):
+        records = self.buffers.pop(partition)
+        self.buffered -= len(records)
+        part = next(self.parts)
+        key = sharded_key(
+            f"data/{self.dataset}/dt={partition}/{self.migration_id}-{part:05d}.parquet",
+            f"{self.migration_id}-{part}",
+        )
+        size = self.storage.put_chunks(key, iter_parquet_chunks(records, self.dataset))
+        self.entries.append({"path": key, "batch_id": self.migration_id, "format": "parquet", "size": size, "rows": len(records)})
+
+    def close(self):
+        """Vuelca las particiones pendientes y retorna las entradas de los archivos escritos."""
+        for partition in list(self.buffers):
+            self.flush(partition)
+        return self.entries
+
+def migration_id_of(key, etag):
+    """Id de la migración de una versión del objeto legacy: el mismo en cada ejecución."""
+    return f"migrate-{uuid.uuid5(uuid.NAMESPACE_URL, f'{key}#{etag}').hex}"
+
+def already_migrated(storage, dataset, key, migration_id):
+    """Indica si esta versión del objeto ya se publicó: su commit existe y el snapshot ya no lo lista."""
+    if key in snapshot_files(load_snapshot(storage, datasets=[dataset]), dataset):
+        return False
+    try:
+        storage.head(commit_key(migration_id))
+    except ObjectNotFound:
+        return False
+    return True
+
+def migrate(storage, dataset, key, attempts=5):
+    """Migra un objeto legacy a Parquet particionado por fecha y lo publica en el manifiesto.
+
+    El id de la migración se deriva del ETag del objeto, de modo que volver a
+    ejecutarla no duplica los datos: una versión ya publicada se omite y una
+    que quedó a medias reescribe los mismos archivos y versiones del log.
+    """
+    etag = storage.head(key)["etag"]
+    migration_id = migration_id_of(key, etag)
+    if already_migrated(storage, dataset, key, migration_id):
+        print(f"{key} ya fue migrado ({migration_id}); se omite")
+        return []
+    writer = PartitionedWriter(storage, dataset, migration_id)
+    start = time.monotonic()
+    rows = 0
+    with closing(open_source(storage, key)) as stream:
+        for record in iter_source_records(stream, key):
+            writer.add(partition_of(record, dataset), record)
+            rows += 1
+            if rows % report_every == 0:
+                report(dataset, rows, start)
+    entries = writer.close()
+    if storage.head(key)["etag"] != etag:
+        storage.delete(entry["path"] for entry in entries)
+        raise RuntimeError(f"{key} cambió durante la migración")
+
+    # Un único commit publica todas las particiones y quita el objeto legacy
+    # del snapshot; el objeto en sí no se modifica ni se borra
+    for attempt in range(attempts):
+        try:
+            commit_cycle(
+                storage, load_snapshot(storage, datasets=[]), migration_id, {dataset: entries}, {dataset: [key]}, operation="MIGRATE",
+            )
+            break
+        except PreconditionFailed:
+            if attempt == attempts - 1:
+                # Sin el registro de commit la próxima ejecución no la da por publicada
+                storage.delete([commit_key(migration_id)])
+                raise
+    report(dataset, rows, start)
+    print(f"{key} migrado a {len(entries)} archivos Parquet")
+    return entries
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra los objetos legacy a Parquet particionado por fecha.")
+    parser.add_argument("datasets", nargs="*", default=sorted(sources), help="Datasets a migrar (por defecto, todos)")
+    parser.add_argument("--local-root", help="Directorio local a usar en lugar del backend configurado")
+    parser.add_argument("--bucket", default="data-lake-simulacion")
+    args = parser.parse_args()
+
+    if args.local_root:
+        storage = LocalStorage(args.local_root)
+    else:
+        storage = create_storage(args.bucket)
+    for dataset in args.datasets:
+        migrate(storage, dataset, sources[dataset])
+
+if __name__ == "__main__":
+    main()
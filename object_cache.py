@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import closing
+import pyarrow as pa
+from arrow_readers import ArrowRecords
+from storage import ObjectNotFound
+from compression import open_decompressed
+
+# Caché de objetos leídos (ya parseados), revalidada con el ETag en cada
+# lectura: OBJECT_CACHE_MB en memoria (0 = desactivada) y, con
+# OBJECT_CACHE_DIR (p. ej. /tmp/object-cache), una copia en disco de hasta
+# OBJECT_CACHE_DISK_MB que sobrevive entre invocaciones de un Lambda caliente.
+# La copia en disco no es ejecutable (JSON o Arrow IPC tras un encabezado JSON),
+# vive en un directorio 0700 y solo se leen archivos del usuario del proceso
+cache_bytes = int(os.environ.get("OBJECT_CACHE_MB", "64")) * 1024 * 1024
+cache_dir = os.environ.get("OBJECT_CACHE_DIR", "")
+disk_bytes = int(os.environ.get("OBJECT_CACHE_DISK_MB", "512")) * 1024 * 1024
+
+class ObjectCache:
+    """Caché read-through de objetos parseados, por bucket y clave.
+
+    Cada lectura envía el ETag guardado con If-None-Match: si el objeto no
+    cambió no se descarga ni se vuelve a parsear. Las entradas se desalojan
+    por tamaño decodificado (el contenido descomprimido o la tabla Arrow, no
+    el objeto comprimido), la menos usada primero.
+    Los valores se comparten entre lectores y no deben modificarse.
+    """
+
+    def __init__(self, bucket, max_bytes=cache_bytes, directory=cache_dir, max_disk_bytes=disk_bytes):
+        self.max_bytes = max_bytes
+        self.directory = os.path.join(directory, bucket) if directory else None
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            try:
+                os.chmod(self.directory, 0o700)
+            except PermissionError:
+                print(f"El directorio {self.directory} es de otro usuario; se desactiva la caché en disco")
+                self.directory = None
+
+    def disk_path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".cache")
+
+    def lookup(self, key):
+        """Entrada (etag, valor, tamaño) en memoria o, si no está, en disco."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        if not self.directory:
+            return None
+        try:
+            with open(self.disk_path(key), "rb") as f:
+                if os.fstat(f.fileno()).st_uid != os.getuid():
+                    return None
+                header = json.loads(f.readline())
+                if header.get("key") != key:
+                    return None
+                return header["etag"], decode_value(header, f.read()), header["size"]
+        except (FileNotFoundError, ValueError, KeyError, pa.ArrowInvalid):
+            return None
+
+    def read(self, storage, key, parse):
+        """Retorna el objeto parseado, descargándolo solo si cambió.
+
+        `parse(contenido)` retorna el valor y su tamaño decodificado. Lanza
+        ObjectNotFound si el objeto no existe.
+        """
+        if self.max_bytes <= 0:
+            return parse(storage.get(key))[0]
+        entry = self.lookup(key)
+        try:
+            result = storage.get_if_changed(key, entry[0] if entry else None)
+        except ObjectNotFound:
+            self.discard(key)
+            raise
+        if result is None:
+            self.store(key, *entry, persist=False)
+            return entry[1]
+        body, etag = result
+        value, size = parse(body)
+        self.store(key, etag, value, size)
+        return value
+
+    def stream(self, storage, key, iterate, compression=None):
+        """Como read, pero entrega los registros a medida que se descargan.
+
+        `iterate(flujo)` decodifica los registros del flujo del objeto, ya
+        descomprimido con `compression`. Si el objeto no cambió se entregan
+        los de la caché; si cambió, se guardan solo si el contenido
+        descomprimido cabe en la caché y se recorrió hasta el final.
+        """
+        if self.max_bytes <= 0:
+            with closing(storage.open(key)) as stream:
+                yield from iterate(open_decompressed(stream, compression))
+            return
+        entry = self.lookup(key)
+        try:
+            result = storage.open_if_changed(key, entry[0] if entry else None)
+        except ObjectNotFound:
+            self.discard(key)
+            raise
+        if result is None:
+            self.store(key, *entry, persist=False)
+            yield from entry[1]
+            return
+        stream, etag = result
+        counted = CountingStream(open_decompressed(stream, compression))
+        records = []
+        with closing(stream), closing(counted):
+            for record in iterate(counted):
+                if records is not None:
+                    records.append(record)
+                    if counted.bytes_read > self.max_bytes:
+                        records = None
+                yield record
+        if records is not None:
+            self.store(key, etag, records, counted.bytes_read)
+
+    def store(self, key, etag, value, size, persist=True):
+        """Guarda el valor parseado de la versión `etag` del objeto (p. ej. tras escribirlo).
+
+        Con `persist` también se escribe la copia en disco.
+        """
+        if size > self.max_bytes:
+            self.discard(key)
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous:
+                self.size -= previous[2]
+            self.entries[key] = (etag, value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+        if self.directory and persist:
+            self.write_disk(key, (etag, value, size))
+
+    def write_disk(self, key, entry):
+        etag, value, size = entry
+        encoded = encode_value(value)
+        if encoded is None:
+            return
+        header, payload = encoded
+        header.update(key=key, etag=etag, size=size)
+        path = self.disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            f.write(payload)
+        os.replace(tmp_path, path)
+        self.evict_disk()
+
+    def evict_disk(self):
+        """Borra los archivos escritos hace más tiempo hasta quedar bajo `max_disk_bytes`."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".cache"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def discard(self, key):
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous:
+                self.size -= previous[2]
+        if self.directory:
+            try:
+                os.remove(self.disk_path(key))
+            except FileNotFoundError:
+                pass
+
+def arrow_bytes(table):
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def encode_value(value):
+    """Encabezado y contenido de la copia en disco de un valor, o None si no se guarda en disco.
+
+    Las listas de registros se guardan como JSON; las tablas Arrow (con los
+    nombres de columna del CSV, si los hay) como Arrow IPC.
+    """
+    if isinstance(value, list):
+        return {"kind": "json"}, json.dumps(value).encode("utf-8")
+    if isinstance(value, ArrowRecords):
+        return {"kind": "arrow"}, arrow_bytes(value.table)
+    if isinstance(value, tuple) and isinstance(value[0], ArrowRecords):
+        return {"kind": "arrow", "fieldnames": value[1]}, arrow_bytes(value[0].table)
+    return None
+
+def decode_value(header, payload):
+    if header["kind"] == "json":
+        return json.loads(payload.decode("utf-8"))
+    records = ArrowRecords(pa.ipc.open_stream(payload).read_all())
+    return (records, header["fieldnames"]) if "fieldnames" in header else records
+
+class CountingStream:
+    """Flujo de lectura que cuenta los bytes leídos."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
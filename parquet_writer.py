@@ -0,0 +1,170 @@
+from itertools import islice
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Tipos anidados reutilizados por varios esquemas
+purchase_type = pa.struct([
+    ("transaction_id", pa.string()),
+    ("product_name", pa.string()),
+    ("purchase_date", pa.string()),
+    ("amount", pa.float64()),
+])
+
+product_line_type = pa.struct([
+    ("product_name", pa.string()),
+    ("category", pa.string()),
+    ("amount", pa.float64()),
+])
+
+transaction_type = pa.struct([
+    ("transaction_id", pa.string()),
+    ("customer_id", pa.string()),
+    ("transaction_date", pa.string()),
+    ("products", pa.list_(product_line_type)),
+    ("total_amount", pa.float64()),
+])
+
+# Esquemas explícitos por dataset
+schemas = {
+    # index.py
+    "customers": pa.schema([
+        ("customer_id", pa.string()),
+        ("customer_name", pa.string()),
+        ("customer_email", pa.string()),
+        ("region", pa.string()),
+        ("total_spent", pa.float64()),
+        ("purchase_history", pa.list_(purchase_type)),
+    ]),
+    "transactions": pa.schema([
+        ("transaction_id", pa.string()),
+        ("customer_id", pa.string()),
+        ("purchase_date", pa.string()),
+        ("product_name", pa.string()),
+        ("amount", pa.float64()),
+    ]),
+    "providers": pa.schema([
+        ("provider_id", pa.string()),
+        ("provider_name", pa.string()),
+        ("product_name", pa.string()),
+        ("contact_email", pa.string()),
+    ]),
+    "products": pa.schema([
+        ("category", pa.string()),
+        ("name", pa.string()),
+        ("price", pa.float64()),
+    ]),
+    "invoices": pa.schema([
+        ("invoice_id", pa.string()),
+        ("transaction_id", pa.string()),
+        ("customer_id", pa.string()),
+        ("amount", pa.float64()),
+        ("invoice_date", pa.string()),
+    ]),
+    # Generadores/generate_customers_data.py
+    "customers_single_transaction": pa.schema([
+        ("customer_id", pa.string()),
+        ("customer_name", pa.string()),
+        ("customer_email", pa.string()),
+        ("region", pa.string()),
+        ("total_spent", pa.float64()),
+        ("transaction", transaction_type),
+    ]),
+    # Generadores/generate_customers_data.py y generate_transactions_data.py
+    "transactions_products": pa.schema(list(transaction_type)),
+    # Generadores/generate_financial_records_data.py
+    "receipts": pa.schema([
+        ("transaction_id", pa.string()),
+        ("customer_id", pa.string()),
+        ("receipt_id", pa.string()),
+        ("amount", pa.float64()),
+        ("receipt_date", pa.string()),
+        ("payment_method", pa.string()),
+        ("notes", pa.string()),
+    ]),
+    # Generadores/generate_inventory_data.py y generate_suppliers_data.py
+    "inventories": pa.schema([
+        ("warehouse_id", pa.string()),
+        ("product_name", pa.string()),
+        ("quantity", pa.int64()),
+        ("last_updated", pa.string()),
+    ]),
+    "inventory_transactions": pa.schema([
+        ("transaction_id", pa.string()),
+        ("warehouse_id", pa.string()),
+        ("product_name", pa.string()),
+        ("transaction_date", pa.string()),
+        ("quantity_sold", pa.int64()),
+        ("amount", pa.float64()),
+    ]),
+}
+
+def coerce_value(value, data_type):
+    """Convierte un valor de Python al tipo Arrow indicado (p. ej. montos guardados como texto)."""
+    if value is None or value == "":
+        return None
+    if pa.types.is_struct(data_type):
+        return {field.name: coerce_value(value.get(field.name), field.type) for field in data_type}
+    if pa.types.is_list(data_type):
+        return [coerce_value(item, data_type.value_type) for item in value]
+    if pa.types.is_floating(data_type):
+        return float(value)
+    if pa.types.is_integer(data_type):
+        return int(value)
+    if pa.types.is_string(data_type):
+        return str(value)
+    return value
+
+def to_table(records, dataset):
+    """Construye una tabla Arrow con el esquema explícito del dataset."""
+    schema = schemas[dataset]
+    rows = [
+        {field.name: coerce_value(record.get(field.name), field.type) for field in schema}
+        for record in records
+    ]
+    return pa.Table.from_pylist(rows, schema=schema)
+
+class ChunkSink:
+    """Destino de escritura que acumula los bytes hasta que se drenan."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_parquet_chunks(records, dataset, row_group_size=10000, compression="snappy", footer=None):
+    """Escribe Parquet grupo de filas a grupo de filas, entregando los bytes producidos.
+
+    `footer` es una función que retorna metadatos clave-valor para el pie del
+    archivo; se llama al final, cuando ya se consumieron todos los registros.
+    """
+    sink = ChunkSink()
+    iterator = iter(records)
+    with pq.ParquetWriter(sink, schemas[dataset], compression=compression) as writer:
+        while True:
+            chunk = list(islice(iterator, row_group_size))
+            if not chunk:
+                break
+            writer.write_table(to_table(chunk, dataset))
+            yield sink.drain()
+        if footer:
+            writer.add_key_value_metadata(footer())
+    yield sink.drain()
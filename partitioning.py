@@ -0,0 +1,121 @@
+import hashlib
+import os
+from collections import defaultdict
+from urllib.parse import unquote
+from settings import dataset_options
+from key_sharding import list_shard_keys
+
+# Columnas de partición estilo Hive por dataset, separadas por "+"
+# (p. ej. PARTITION_COLUMNS="customers=region,transactions=category"); las
+# carpetas col=valor quedan antes de dt=/hour= y solo aplican al modo particionado
+partition_columns = dataset_options("PARTITION_COLUMNS", {
+    "customers": "",
+    "transactions": "",
+    "providers": "",
+    "products": "",
+    "invoices": "",
+})
+
+# Buckets por hash de una columna (BUCKET_COUNT=0 desactiva). Clientes,
+# transacciones y facturas usan el mismo número de buckets sobre customer_id,
+# de modo que sus joins se pueden resolver bucket a bucket y en paralelo
+bucket_count = int(os.environ.get("BUCKET_COUNT", "0"))
+bucket_columns = dataset_options("BUCKET_COLUMNS", {
+    "customers": "customer_id",
+    "transactions": "customer_id",
+    "providers": "",
+    "products": "",
+    "invoices": "customer_id",
+})
+
+# Particiones de un mismo dataset que se suben a la vez
+max_open_writers = int(os.environ.get("PARTITION_MAX_WRITERS", "4"))
+
+# Partición de los registros sin valor (convención de Hive)
+default_partition = "__HIVE_DEFAULT_PARTITION__"
+
+# Caracteres que Hive escapa como %XX en los nombres de partición
+escaped_chars = set('"#%\'*/:=?\\\x7f{[]^')
+
+def columns_of(dataset):
+    return [column for column in partition_columns.get(dataset, "").split("+") if column]
+
+def bucket_column(dataset):
+    """Columna de bucketing del dataset, o None si no se usan buckets."""
+    return (bucket_columns.get(dataset) or None) if bucket_count > 0 else None
+
+def bucket_of(value, buckets=bucket_count):
+    """Bucket de un valor: hash estable entre procesos (a diferencia de hash())."""
+    digest = hashlib.md5(("" if value is None else str(value)).encode("utf-8")).hexdigest()
+    return int(digest, 16) % buckets
+
+def escape_value(value):
+    """Escapa un valor de partición como Hive (FileUtils.escapePathName)."""
+    if value is None or value == "":
+        return default_partition
+    return "".join(
+        f"%{ord(char):02X}" if char in escaped_chars or ord(char) < 0x20 else char
+        for char in str(value)
+    )
+
+def partition_path(values):
+    """Carpetas col=valor/ de una partición, en el orden de las columnas."""
+    return "".join(f"{column}={escape_value(value)}/" for column, value in values.items())
+
+def parse_partition_values(key):
+    """Valores de partición (sin escapar) presentes en las carpetas de una clave."""
+    values = {}
+    for segment in key.split("/")[:-1]:
+        column, equals, value = segment.partition("=")
+        if equals:
+            values[column] = None if value == default_partition else unquote(value)
+    return values
+
+def partition_values(record, columns, derived=None):
+    """Valores de partición del registro; `derived` calcula las columnas que no trae."""
+    derived = derived or {}
+    return {
+        column: derived[column](record) if column not in record and column in derived else record.get(column)
+        for column in columns
+    }
+
+def split_partitions(records, columns, derived=None, bucket_by=None, buckets=bucket_count):
+    """Agrupa los registros por partición y bucket.
+
+    Retorna {(carpetas col=valor/, bucket): (valores, registros)}; el bucket
+    es None si no se indica `bucket_by`.
+    """
+    partitions = defaultdict(list)
+    values_by_path = {}
+    for record in records:
+        values = partition_values(record, columns, derived)
+        path = partition_path(values)
+        bucket = bucket_of(record.get(bucket_by), buckets) if bucket_by else None
+        values_by_path[path] = values
+        partitions[(path, bucket)].append(record)
+    return {
+        (path, bucket): (values_by_path[path], partitions[(path, bucket)])
+        for path, bucket in sorted(partitions, key=lambda group: (group[0], -1 if group[1] is None else group[1]))
+    }
+
+def partition_prefix(dataset, values):
+    """Prefijo más largo que fijan los valores dados (las columnas iniciales de la partición)."""
+    prefix = f"data/{dataset}/"
+    for column in columns_of(dataset):
+        if column not in values:
+            break
+        prefix += f"{column}={escape_value(values[column])}/"
+    return prefix
+
+def matches_partition(key, values):
+    found = parse_partition_values(key)
+    return all(found.get(column) == (None if value in (None, "") else str(value)) for column, value in values.items())
+
+def list_partition_keys(storage, dataset, values):
+    """Claves de datos de una partición, sin leer el manifiesto.
+
+    Solo se lista el prefijo que fijan los valores (en todos los shards); las
+    columnas restantes se filtran por la ruta. Se omiten el log y los auxiliares.
+    """
+    keys = list_shard_keys(storage, partition_prefix(dataset, values))
+    return [key for key in keys if "/_" not in key and matches_partition(key, values)]
@@ -0,0 +1,87 @@
+import math
+import os
+from streaming_upload import iter_serialized
+
+# Tamaño objetivo por objeto escrito: MiB tal como se escriben (formato y
+# compresión reales) y/o filas (0 = sin objetivo)
+target_bytes = int(float(os.environ.get("TARGET_OBJECT_MB", "0")) * 1024 * 1024)
+target_rows = int(os.environ.get("TARGET_OBJECT_ROWS", "0"))
+
+# Pasos de medición de un generador de una sola ejecución antes de dar el tamaño por bueno
+max_measurements = 4
+
+def serialized_size(format_type, schema=None, compression=None):
+    """Función que mide los bytes de unos registros serializados en el formato y compresión en que se escriben."""
+    return lambda records: sum(len(chunk) for chunk in iter_serialized(records, format_type, schema, compression=compression))
+
+class RolloverPolicy:
+    """Decide cuántos registros generar para que cada objeto escrito alcance el objetivo.
+
+    Sin objetivos configurados se genera un lote de `initial_batch_size` (el
+    comportamiento anterior). Con objetivos, la política aprende de los
+    objetos escritos: por cada dataset que sale de los registros generados,
+    cuántas filas y bytes (los del objeto real) aporta cada registro generado
+    a un objeto promedio. Un lote que se reparte en varias particiones o
+    buckets deja objetos más pequeños, y eso se compensa generando más. Con
+    varios datasets derivados del mismo generador (p. ej. clientes,
+    transacciones y facturas) el tamaño lo fija el que primero llega al
+    objetivo. Las mediciones se conservan entre ciclos.
+    """
+
+    def __init__(self, initial_batch_size, target_bytes=target_bytes, target_rows=target_rows,
+                 max_batch_size=100000, smoothing=0.5):
+        self.initial_batch_size = initial_batch_size
+        self.target_bytes = target_bytes
+        self.target_rows = target_rows
+        self.max_batch_size = max_batch_size
+        self.smoothing = smoothing
+        self.per_record = {}
+
+    def has_target(self):
+        return self.target_bytes > 0 or self.target_rows > 0
+
+    def observe(self, dataset, generated, objects):
+        """Registra los objetos [(filas, bytes)] que `dataset` escribió a partir de `generated` registros."""
+        if not generated or not objects:
+            return
+        rows = sum(rows for rows, _ in objects) / len(objects) / generated
+        size = sum(size for _, size in objects) / len(objects) / generated
+        previous = self.per_record.get(dataset)
+        if previous is not None:
+            rows = previous[0] + self.smoothing * (rows - previous[0])
+            size = previous[1] + self.smoothing * (size - previous[1])
+        self.per_record[dataset] = (rows, size)
+
+    def batch_size(self):
+        """Cantidad de registros a generar para el siguiente objeto."""
+        if not self.has_target() or not self.per_record:
+            return self.initial_batch_size
+        candidates = []
+        for rows, size in self.per_record.values():
+            if self.target_rows > 0 and rows > 0:
+                candidates.append(self.target_rows / rows)
+            if self.target_bytes > 0 and size > 0:
+                candidates.append(self.target_bytes / size)
+        if not candidates:
+            return self.initial_batch_size
+        return max(1, min(math.ceil(min(candidates)), self.max_batch_size))
+
+def generate_records(generate_one, policy, dataset=None, measure=None):
+    """Genera los registros de un lote según la política.
+
+    Un proceso de larga duración alimenta la política con los objetos que
+    escribe (observe) y genera directamente `batch_size()` registros. Un
+    generador de una sola ejecución no tiene esa historia: con `measure`
+    (ver serialized_size) mide lo generado tal como se escribirá y completa
+    el lote hasta el objetivo.
+    """
+    records = [generate_one() for _ in range(policy.batch_size())]
+    if measure is None or not policy.has_target():
+        return records
+    for _ in range(max_measurements):
+        policy.observe(dataset, len(records), [(len(records), measure(records))])
+        missing = policy.batch_size() - len(records)
+        if missing <= 0:
+            break
+        records.extend(generate_one() for _ in range(missing))
+    return records
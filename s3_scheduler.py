@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from botocore.config import Config
+from botocore.retries import standard
+
+# Solicitudes por segundo por prefijo de clave (S3 admite unas 3500 escrituras
+# y 5500 lecturas por segundo por prefijo antes de responder SlowDown)
+prefix_rate = float(os.environ.get("S3_PREFIX_RATE", "3000"))
+min_rate = 5.0
+
+# Los limitadores de prefijos sin solicitudes durante este tiempo se
+# descartan, y nunca se conservan más de este número (los menos usados
+# recientemente salen primero): una carpeta hoja por partición no los hace
+# crecer sin límite
+bucket_idle_seconds = float(os.environ.get("S3_BUCKET_IDLE_SECONDS", "300"))
+max_buckets = int(os.environ.get("S3_MAX_PREFIX_BUCKETS", "1024"))
+
+# Intentos por solicitud del modo de reintento "adaptive" de botocore
+# (espera exponencial con jitter y limitación de la tasa del cliente)
+max_attempts = int(os.environ.get("S3_MAX_ATTEMPTS", "10"))
+
+def retry_config(client_config=None):
+    """Configuración de botocore con reintentos adaptativos, combinada con `client_config`."""
+    config = Config(retries={"mode": "adaptive", "max_attempts": max_attempts})
+    return config.merge(client_config) if client_config else config
+
+def prefix_of(params):
+    """Prefijo al que S3 asigna la solicitud: la carpeta de la clave o el prefijo listado."""
+    key = params.get("Key") or params.get("Prefix") or ""
+    return key.rpartition("/")[0]
+
+class TokenBucket:
+    """Token bucket con tasa adaptativa: se reduce a la mitad ante un throttle
+    y vuelve a subir de a poco con cada respuesta exitosa."""
+
+    def __init__(self, rate, increase=None):
+        self.max_rate = rate
+        self.rate = rate
+        self.increase = increase or rate / 1000
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Espera hasta que haya un token disponible y lo consume."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_throttle(self):
+        with self.lock:
+            self.rate = max(min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, self.rate)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+class RequestScheduler:
+    """Limita la tasa de solicitudes a S3 por prefijo y registra throttles y reintentos.
+
+    Se engancha a los eventos de botocore, por lo que también cubre las
+    partes de las subidas multiparte de s3transfer.
+    """
+
+    def __init__(self, rate=prefix_rate):
+        self.rate = rate
+        self.buckets = OrderedDict()
+        self.metrics = defaultdict(lambda: {"requests": 0, "throttles": 0, "retries": 0, "retry_seconds": 0.0, "errors": 0})
+        self.lock = threading.Lock()
+        self.throttling_detector = standard.ThrottlingErrorDetector(standard.RetryEventAdapter())
+
+    def attach(self, s3_client):
+        events = s3_client.meta.events
+        events.register("before-parameter-build.s3", self.before_call)
+        events.register("needs-retry.s3", self.on_attempt)
+        events.register("after-call.s3", self.after_call)
+        events.register("after-call-error.s3", self.after_call_error)
+        return s3_client
+
+    def bucket(self, prefix):
+        with self.lock:
+            bucket = self.buckets.get(prefix)
+            if bucket is None:
+                bucket = self.buckets[prefix] = TokenBucket(self.rate)
+            self.buckets.move_to_end(prefix)
+            self.evict_idle()
+            return bucket
+
+    def evict_idle(self):
+        """Descarta los limitadores menos usados si sobran o llevan demasiado sin uso (con el lock tomado)."""
+        now = time.monotonic()
+        while len(self.buckets) > 1:
+            prefix, bucket = next(iter(self.buckets.items()))
+            if len(self.buckets) <= max_buckets and now - bucket.updated < bucket_idle_seconds:
+                break
+            del self.buckets[prefix]
+
+    def record(self, prefix, **values):
+        with self.lock:
+            metrics = self.metrics[prefix]
+            for name, value in values.items():
+                metrics[name] += value
+
+    def before_call(self, params, context, **kwargs):
+        prefix = prefix_of(params)
+        context["scheduler_prefix"] = prefix
+        self.bucket(prefix).acquire()
+        context["scheduler_start"] = time.monotonic()
+
+    def on_attempt(self, request_dict, **kwargs):
+        prefix = request_dict["context"].get("scheduler_prefix")
+        if prefix is not None and self.throttling_detector.is_throttling_error(request_dict=request_dict, **kwargs):
+            self.bucket(prefix).on_throttle()
+            self.record(prefix, throttles=1)
+
+    def finish(self, context, retries, failed):
+        prefix = context.get("scheduler_prefix")
+        if prefix is None:
+            return
+        values = {"requests": 1, "retries": retries, "errors": int(failed)}
+        if retries:
+            values["retry_seconds"] = time.monotonic() - context["scheduler_start"]
+        self.record(prefix, **values)
+        if not failed:
+            self.bucket(prefix).on_success()
+
+    def after_call(self, http_response, parsed, context, **kwargs):
+        retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        self.finish(context, retries, failed=http_response.status_code >= 400)
+
+    def after_call_error(self, context, **kwargs):
+        self.finish(context, 0, failed=True)
+
+    def drain_metrics(self):
+        """Retorna las métricas acumuladas por prefijo y las reinicia."""
+        with self.lock:
+            metrics = {prefix: dict(values) for prefix, values in self.metrics.items()}
+            self.metrics.clear()
+        return metrics
+
+    def report(self, drained=None):
+        """Imprime los prefijos que sufrieron throttling o reintentos desde el último reporte.
+
+        `drained` permite pasar las métricas ya obtenidas con drain_metrics().
+        """
+        drained = self.drain_metrics() if drained is None else drained
+        for prefix, metrics in sorted(drained.items()):
+            if metrics["throttles"] or metrics["retries"] or metrics["errors"]:
+                with self.lock:
+                    bucket = self.buckets.get(prefix)
+                rate = f"{bucket.rate:.0f}/s" if bucket else "sin limitador activo"
+                print(
+                    f"S3 {prefix or '/'}: {metrics['requests']} solicitudes, {metrics['throttles']} throttles, "
+                    f"{metrics['retries']} reintentos ({metrics['retry_seconds']:.1f} s), {metrics['errors']} errores, "
+                    f"tasa {rate}"
+                )
+
+# Planificador compartido por todos los clientes del proceso
+scheduler = RequestScheduler()
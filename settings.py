@@ -0,0 +1,15 @@
+import os
+
+def dataset_options(env_name, defaults):
+    """Combina opciones por dataset con la variable de entorno indicada.
+
+    La variable tiene la forma "dataset=valor,dataset=valor"; los datasets que
+    no aparecen conservan su valor por defecto.
+    """
+    options = dict(defaults)
+    raw = os.environ.get(env_name, "")
+    for item in raw.split(","):
+        if "=" in item:
+            dataset, value = item.split("=", 1)
+            options[dataset.strip()] = value.strip()
+    return options
@@ -0,0 +1,164 @@
+import json
+import mmap
+import os
+import random
+import time
+import uuid
+
+# Directorio raíz del spool local (vacío = subir directamente a S3)
+spool_root = os.environ.get("SPOOL_DIR", "")
+
+# Reintentos del drenado: intentos por segmento (0 = sin límite) y espera máxima
+max_attempts = int(os.environ.get("SPOOL_MAX_ATTEMPTS", "0"))
+max_backoff = float(os.environ.get("SPOOL_MAX_BACKOFF_SECONDS", "60"))
+
+# Intentos de una subida directa (sin spool) antes de darla por fallida
+direct_attempts = int(os.environ.get("UPLOAD_ATTEMPTS", "3"))
+
+# Inicio del proceso: un .tmp sin dueño conocido y anterior a este momento es de una caída
+process_start = time.time()
+
+def spool_directory(name):
+    """Directorio de spool de un generador, o None si SPOOL_DIR no está definido."""
+    if not spool_root:
+        return None
+    path = os.path.join(spool_root, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def fsync_directory(path):
+    """Sincroniza el directorio para que el renombrado sobreviva a una caída."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_segment(spool, records, metadata):
+    """Escribe un segmento NDJSON (metadatos + registros) de forma durable.
+
+    El segmento se escribe como .tmp (con el PID del proceso que lo escribe),
+    se sincroniza con fsync y se renombra a .seg; solo los .seg están
+    completos y se suben.
+    """
+    name = f"{time.time_ns():020d}-{uuid.uuid4().hex}"
+    tmp_path = os.path.join(spool, f"{name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(metadata) + "\n")
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    path = os.path.join(spool, name + ".seg")
+    os.rename(tmp_path, path)
+    fsync_directory(spool)
+    return path
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def abandoned(path):
+    """Indica si un .tmp quedó de una caída y no de una escritura en curso.
+
+    Lo es si el proceso que lo escribe ya no existe; los .tmp sin PID (de
+    versiones anteriores) solo si son anteriores al inicio de este proceso.
+    """
+    owner = os.path.basename(path)[:-len(".tmp")].rpartition(".")[2]
+    if owner.isdigit():
+        return int(owner) != os.getpid() and not process_alive(int(owner))
+    try:
+        return os.path.getmtime(path) < process_start
+    except FileNotFoundError:
+        return False
+
+def pending_segments(spool):
+    """Segmentos completos pendientes de subir, en orden de escritura.
+
+    Los .tmp que quedaron de una caída están incompletos y se descartan; los
+    que otro hilo o proceso está escribiendo se dejan en paz.
+    """
+    segments = []
+    for filename in sorted(os.listdir(spool)):
+        path = os.path.join(spool, filename)
+        if filename.endswith(".tmp"):
+            if abandoned(path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        elif filename.endswith(".seg"):
+            segments.append(path)
+    return segments
+
+def replay_segment(path, upload):
+    """Sube un segmento leyéndolo con mmap: upload(registros, **metadatos)."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as segment:
+        metadata = json.loads(segment.readline())
+        records = (json.loads(line) for line in iter(segment.readline, b""))
+        if upload(records, **metadata) is False:
+            raise RuntimeError(f"La subida de {path} no se completó")
+
+def backoff_delay(attempt):
+    """Espera exponencial con jitter para el intento `attempt`."""
+    return min(max_backoff, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+def drain(spool, upload, max_attempts=max_attempts):
+    """Sube los segmentos pendientes en orden, con reintentos y espera exponencial.
+
+    Un segmento se borra solo después de subirse; si agota los intentos queda
+    en disco para la siguiente ejecución. Retorna True si el spool quedó vacío.
+    """
+    for path in pending_segments(spool):
+        attempt = 0
+        while True:
+            try:
+                replay_segment(path, upload)
+                os.remove(path)
+                break
+            except Exception as e:
+                attempt += 1
+                if max_attempts and attempt >= max_attempts:
+                    print(f"Error al subir el segmento {path}; se reintentará más tarde: {e}")
+                    return False
+                delay = backoff_delay(attempt)
+                print(f"Error al subir el segmento {path} (intento {attempt}): {e}; reintento en {delay:.1f} s")
+                time.sleep(delay)
+    return True
+
+def drain_forever(spool, upload, poll_interval=1.0):
+    """Drena el spool continuamente; pensado para un hilo o proceso de subida aparte."""
+    while True:
+        drain(spool, upload)
+        time.sleep(poll_interval)
+
+def deliver(upload, records, attempts=direct_attempts, **metadata):
+    """Llama a upload reintentando con espera exponencial si falla o retorna False.
+
+    Los registros deben poder recorrerse de nuevo (una lista, no un generador).
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            result = upload(records, **metadata)
+            if result is not False or attempt == attempts:
+                return result
+            error = "la subida retornó False"
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            error = e
+        delay = backoff_delay(attempt)
+        print(f"Error en la subida (intento {attempt}): {error}; reintento en {delay:.1f} s")
+        time.sleep(delay)
+
+def publish(spool, upload, records, **metadata):
+    """Guarda los registros en el spool o, sin spool, los sube directamente con reintentos."""
+    if spool is None:
+        return deliver(upload, records, **metadata)
+    path = write_segment(spool, records, metadata)
+    print(f"Lote guardado en el spool: {path}")
@@ -0,0 +1,487 @@
+import fcntl
+import hashlib
+import io
+import json
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.exceptions import ClientError
+from streaming_upload import RecordStream, transfer_config
+from s3_scheduler import scheduler, retry_config
+
+# Backend de almacenamiento: "s3", "local" (directorio STORAGE_ROOT) o "memory"
+# (en el proceso, para medir generación y serialización sin red)
+storage_backend = os.environ.get("STORAGE_BACKEND", "s3")
+storage_root = os.environ.get("STORAGE_ROOT", "local_data")
+storage_mmap = os.environ.get("STORAGE_MMAP", "false").lower() == "true"
+
+# Descargas de objetos grandes: GETs por rango de DOWNLOAD_PART_SIZE_MB, hasta
+# DOWNLOAD_MAX_CONCURRENCY a la vez, escritos directo en un búfer del tamaño
+# del objeto (un objeto de una sola parte se descarga con un único GET)
+download_part_size = int(os.environ.get("DOWNLOAD_PART_SIZE_MB", "8")) * 1024 * 1024
+download_concurrency = int(os.environ.get("DOWNLOAD_MAX_CONCURRENCY", "8"))
+
+# Bytes que se copian de una vez desde la respuesta al búfer
+read_chunk_size = 1024 * 1024
+
+# Límites de S3 para las subidas multiparte: tamaño mínimo de toda parte
+# salvo la última y máximo de una parte copiada con UploadPartCopy
+min_part_size = 5 * 1024 * 1024
+max_copy_part_size = 5 * 1024 * 1024 * 1024
+
+class ObjectNotFound(Exception):
+    """El objeto solicitado no existe."""
+
+class PreconditionFailed(Exception):
+    """No se cumplió la condición de una escritura condicional."""
+
+def create_storage(bucket, client_config=None, backend=None):
+    """Crea el backend configurado.
+
+    En S3 el cliente usa `client_config` con reintentos adaptativos y pasa
+    por el planificador de solicitudes (límite de tasa por prefijo).
+    """
+    backend = backend or storage_backend
+    if backend == "s3":
+        return S3Storage(scheduler.attach(boto3.client("s3", config=retry_config(client_config))), bucket)
+    if backend == "local":
+        return LocalStorage(os.path.join(storage_root, bucket), use_mmap=storage_mmap)
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Backend de almacenamiento no soportado: {backend}")
+
+def read_into(body, target):
+    """Copia por bloques el cuerpo de una respuesta en `target` (una vista del búfer)."""
+    position = 0
+    for chunk in body.iter_chunks(read_chunk_size):
+        target[position:position + len(chunk)] = chunk
+        position += len(chunk)
+
+class S3Storage:
+    """Almacenamiento sobre un bucket de S3."""
+
+    def __init__(self, s3_client, bucket, part_size=download_part_size, max_concurrency=download_concurrency):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+
+    def download(self, key, conditions=None, attempts=3):
+        """Descarga el objeto completo y retorna (contenido, ETag).
+
+        El primer GET pide solo la primera parte y de su Content-Range se
+        obtiene el tamaño; si el objeto es mayor, el resto se pide en rangos
+        de `part_size` en paralelo (con If-Match, para no mezclar versiones)
+        directo sobre un bytearray reservado de antemano, que se retorna sin
+        volver a copiarlo. `conditions` se agrega al primer GET (p. ej.
+        IfNoneMatch). Si el objeto cambia a mitad de la descarga se reintenta.
+        """
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket, Key=key, Range=f"bytes=0-{self.part_size - 1}", **(conditions or {}),
+            )
+        except self.s3_client.exceptions.NoSuchKey:
+            raise ObjectNotFound(key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "InvalidRange":
+                raise
+            # Un objeto vacío no admite rangos
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=key, **(conditions or {}))
+        etag = response["ETag"]
+        size = int(response["ContentRange"].rsplit("/", 1)[1]) if response.get("ContentRange") else None
+        if size is None or size <= self.part_size:
+            return response["Body"].read(), etag
+
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        read_into(response["Body"], view[:self.part_size])
+        starts = range(self.part_size, size, self.part_size)
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(starts))) as executor:
+                futures = [executor.submit(self.read_range, key, etag, start, view[start:start + self.part_size]) for start in starts]
+                for future in futures:
+                    future.result()
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "PreconditionFailed" or attempts <= 1:
+                raise
+            return self.download(key, conditions, attempts - 1)
+        return buffer, etag
+
+    def read_range(self, key, etag, start, target):
+        response = self.s3_client.get_object(
+            Bucket=self.bucket, Key=key, Range=f"bytes={start}-{start + len(target) - 1}", IfMatch=etag,
+        )
+        read_into(response["Body"], target)
+
+    def get_with_etag(self, key):
+        """Retorna el contenido y el ETag de un objeto (en partes paralelas si es grande)."""
+        return self.download(key)
+
+    def get(self, key):
+        return self.get_with_etag(key)[0]
+
+    def get_if_changed(self, key, etag):
+        """Retorna (contenido, ETag) si el ETag del objeto ya no es `etag`, o None si no cambió.
+
+        Se usa If-None-Match, de modo que un objeto sin cambios no se descarga.
+        """
+        try:
+            return self.download(key, {"IfNoneMatch": etag} if etag else None)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("304", "NotModified"):
+                return None
+            raise
+
+    def open_if_changed(self, key, etag):
+        """Como get_if_changed, pero retorna (flujo, ETag) sin descargar el contenido."""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=key, **({"IfNoneMatch": etag} if etag else {}))
+        except self.s3_client.exceptions.NoSuchKey:
+            raise ObjectNotFound(key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("304", "NotModified"):
+                return None
+            raise
+        return response["Body"], response["ETag"]
+
+    def get_range(self, key, start, end):
+        """Retorna los bytes [start, end) del objeto."""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+        except self.s3_client.exceptions.NoSuchKey:
+            raise ObjectNotFound(key)
+        return response["Body"].read()
+
+    def open(self, key):
+        """Abre el objeto como flujo binario de lectura, sin descargarlo completo."""
+        try:
+            return self.s3_client.get_object(Bucket=self.bucket, Key=key)["Body"]
+        except self.s3_client.exceptions.NoSuchKey:
+            raise ObjectNotFound(key)
+
+    def put(self, key, body, if_none_match=False, if_match=None):
+        """Escribe un objeto y retorna su ETag.
+
+        Con `if_none_match` solo se escribe si no existe; con `if_match` solo
+        si su ETag actual coincide.
+        """
+        conditions = {}
+        if if_none_match:
+            conditions["IfNoneMatch"] = "*"
+        if if_match:
+            conditions["IfMatch"] = if_match
+        try:
+            response = self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=body, **conditions)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+                raise PreconditionFailed(key)
+            raise
+        return response["ETag"]
+
+    def put_chunks(self, key, chunks, extra_args=None, config=None):
+        """Sube en streaming un generador de bloques de bytes y retorna el tamaño escrito."""
+        stream = RecordStream(chunks)
+        self.s3_client.upload_fileobj(stream, self.bucket, key, ExtraArgs=extra_args or {}, Config=config or transfer_config)
+        return stream.bytes_read
+
+    def append(self, key, body, size, etag, extra_args=None):
+        """Agrega `body` al final del objeto (de `size` bytes y ETag `etag`) y retorna el nuevo tamaño.
+
+        El contenido existente no se descarga: una subida multiparte copia el
+        objeto en el servidor (UploadPartCopy, solo si su ETag sigue siendo
+        `etag`) y agrega `body` como última parte. Como las partes previas
+        deben medir al menos 5 MiB, un objeto menor se lee y se reescribe.
+        Si el objeto cambió se lanza PreconditionFailed.
+        """
+        if size < min_part_size:
+            existing, current = self.get_with_etag(key)
+            if current != etag:
+                raise PreconditionFailed(key)
+            return self.put_chunks(key, [existing, body], extra_args)
+        upload_id = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=key, **(extra_args or {}))["UploadId"]
+        try:
+            parts = []
+            copies = -(-size // max_copy_part_size)
+            copy_size = -(-size // copies)
+            for start in range(0, size, copy_size):
+                response = self.s3_client.upload_part_copy(
+                    Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1,
+                    CopySource={"Bucket": self.bucket, "Key": key}, CopySourceIfMatch=etag,
+                    CopySourceRange=f"bytes={start}-{min(start + copy_size, size) - 1}",
+                )
+                parts.append({"PartNumber": len(parts) + 1, "ETag": response["CopyPartResult"]["ETag"]})
+            response = self.s3_client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1, Body=body)
+            parts.append({"PartNumber": len(parts) + 1, "ETag": response["ETag"]})
+            self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+        except Exception as e:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            if isinstance(e, ClientError) and e.response["Error"]["Code"] == "PreconditionFailed":
+                raise PreconditionFailed(key)
+            raise
+        return size + len(body)
+
+    def head(self, key):
+        """Tamaño, ETag, metadatos y ContentEncoding del objeto."""
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            # HEAD no trae cuerpo: S3 informa el objeto inexistente solo con el 404.
+            # Un throttle, un 403 o un 5xx se propagan para no confundirlos con un objeto nuevo
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                raise ObjectNotFound(key)
+            raise
+        return {
+            "size": response["ContentLength"],
+            "etag": response["ETag"],
+            "metadata": response.get("Metadata", {}),
+            "content_encoding": response.get("ContentEncoding"),
+        }
+
+    def size(self, key):
+        return self.head(key)["size"]
+
+    def list(self, prefix):
+        """Claves bajo un prefijo, en orden."""
+        keys = []
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(item["Key"] for item in page.get("Contents", []))
+        return sorted(keys)
+
+    def delete(self, keys):
+        """Borra las claves en lotes de 1000 (el máximo de DeleteObjects)."""
+        keys = list(keys)
+        for start in range(0, len(keys), 1000):
+            objects = [{"Key": key} for key in keys[start:start + 1000]]
+            self.s3_client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+
+def object_info(body, extra_args):
+    """Metadatos que los backends sin S3 guardan junto al objeto."""
+    extra_args = extra_args or {}
+    return {
+        "size": len(body),
+        "etag": hashlib.md5(body).hexdigest(),
+        "metadata": extra_args.get("Metadata", {}),
+        "content_encoding": extra_args.get("ContentEncoding"),
+    }
+
+class LocalStorage:
+    """Almacenamiento sobre un directorio local, con las mismas claves que en S3.
+
+    Las escrituras son atómicas (archivo temporal + renombrado) y las
+    condicionales se serializan con un lock de archivo. Los metadatos de cada
+    objeto se guardan aparte en .meta/. Con `use_mmap` las lecturas mapean
+    el archivo en memoria en lugar de leerlo por bloques.
+    """
+
+    def __init__(self, root, use_mmap=False):
+        self.root = root
+        self.use_mmap = use_mmap
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def meta_path(self, key):
+        return os.path.join(self.root, ".meta", *key.split("/")) + ".json"
+
+    def read(self, key, start=0, end=None):
+        try:
+            with open(self.path(key), "rb") as f:
+                if self.use_mmap and os.fstat(f.fileno()).st_size > 0:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        return mapped[start:end]
+                f.seek(start)
+                return f.read() if end is None else f.read(max(0, end - start))
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+
+    def get_with_etag(self, key):
+        body = self.read(key)
+        return body, hashlib.md5(body).hexdigest()
+
+    def get(self, key):
+        return self.read(key)
+
+    def get_if_changed(self, key, etag):
+        body, current = self.get_with_etag(key)
+        return None if current == etag else (body, current)
+
+    def open_if_changed(self, key, etag):
+        result = self.get_if_changed(key, etag)
+        return result and (io.BytesIO(result[0]), result[1])
+
+    def get_range(self, key, start, end):
+        return self.read(key, start, end)
+
+    def open(self, key):
+        try:
+            return open(self.path(key), "rb")
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+
+    def write_file(self, key, chunks, extra_args=None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        size = 0
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        # Los metadatos (id de lote, ContentEncoding) se guardan solo si existen
+        meta_path = self.meta_path(key)
+        extra_args = extra_args or {}
+        if extra_args.get("Metadata") or extra_args.get("ContentEncoding"):
+            os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+            with open(meta_path, "w") as f:
+                json.dump({"metadata": extra_args.get("Metadata", {}), "content_encoding": extra_args.get("ContentEncoding")}, f)
+        elif os.path.exists(meta_path):
+            os.remove(meta_path)
+        return size
+
+    def put(self, key, body, if_none_match=False, if_match=None):
+        body = body.encode("utf-8") if isinstance(body, str) else body
+        if not if_none_match and not if_match:
+            self.write_file(key, [body])
+            return hashlib.md5(body).hexdigest()
+        with open(os.path.join(self.root, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                current = self.get_with_etag(key)[1]
+            except ObjectNotFound:
+                current = None
+            if (if_none_match and current is not None) or (if_match and current != if_match):
+                raise PreconditionFailed(key)
+            self.write_file(key, [body])
+        return hashlib.md5(body).hexdigest()
+
+    def put_chunks(self, key, chunks, extra_args=None, config=None):
+        return self.write_file(key, chunks, extra_args)
+
+    def append(self, key, body, size, etag, extra_args=None):
+        with open(os.path.join(self.root, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            existing, current = self.get_with_etag(key)
+            if current != etag:
+                raise PreconditionFailed(key)
+            return self.write_file(key, [existing, body], extra_args)
+
+    def head(self, key):
+        info = {"metadata": {}, "content_encoding": None}
+        try:
+            with open(self.meta_path(key)) as f:
+                info.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        info["size"] = self.size(key)
+        info["etag"] = self.get_with_etag(key)[1]
+        return info
+
+    def size(self, key):
+        try:
+            return os.path.getsize(self.path(key))
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+
+    def list(self, prefix):
+        # Se recorre solo el directorio más profundo que contiene el prefijo
+        folder = prefix.rpartition("/")[0]
+        keys = []
+        for directory, _, filenames in os.walk(self.path(folder) if folder else self.root):
+            relative = os.path.relpath(directory, self.root).replace(os.sep, "/")
+            for filename in filenames:
+                key = filename if relative == "." else f"{relative}/{filename}"
+                if key.startswith(prefix) and not filename.endswith(".tmp") and not key.startswith((".lock", ".meta/")):
+                    keys.append(key)
+        return sorted(keys)
+
+    def delete(self, keys):
+        for key in keys:
+            for path in (self.path(key), self.meta_path(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+# Objetos del backend en memoria, compartidos por todas las instancias del proceso
+memory_objects = {}
+memory_lock = threading.Lock()
+
+class MemoryStorage:
+    """Almacenamiento en memoria del proceso, para pruebas y mediciones sin red ni disco."""
+
+    def __init__(self, objects=None):
+        self.objects = memory_objects if objects is None else objects
+
+    def get_with_etag(self, key):
+        try:
+            body, info = self.objects[key]
+        except KeyError:
+            raise ObjectNotFound(key)
+        return body, info["etag"]
+
+    def get(self, key):
+        return self.get_with_etag(key)[0]
+
+    def get_if_changed(self, key, etag):
+        body, current = self.get_with_etag(key)
+        return None if current == etag else (body, current)
+
+    def open_if_changed(self, key, etag):
+        result = self.get_if_changed(key, etag)
+        return result and (io.BytesIO(result[0]), result[1])
+
+    def get_range(self, key, start, end):
+        return self.get(key)[start:end]
+
+    def open(self, key):
+        return io.BytesIO(self.get(key))
+
+    def put(self, key, body, if_none_match=False, if_match=None):
+        body = body.encode("utf-8") if isinstance(body, str) else bytes(body)
+        with memory_lock:
+            current = self.objects.get(key)
+            if (if_none_match and current is not None) or (if_match and (current is None or current[1]["etag"] != if_match)):
+                raise PreconditionFailed(key)
+            info = object_info(body, None)
+            self.objects[key] = (body, info)
+        return info["etag"]
+
+    def put_chunks(self, key, chunks, extra_args=None, config=None):
+        body = b"".join(chunks)
+        with memory_lock:
+            self.objects[key] = (body, object_info(body, extra_args))
+        return len(body)
+
+    def append(self, key, body, size, etag, extra_args=None):
+        with memory_lock:
+            existing, info = self.objects.get(key, (None, None))
+            if info is None or info["etag"] != etag:
+                raise PreconditionFailed(key)
+            existing += body
+            self.objects[key] = (existing, object_info(existing, extra_args))
+        return len(existing)
+
+    def head(self, key):
+        try:
+            return dict(self.objects[key][1])
+        except KeyError:
+            raise ObjectNotFound(key)
+
+    def size(self, key):
+        return self.head(key)["size"]
+
+    def list(self, prefix):
+        return sorted(key for key in list(self.objects) if key.startswith(prefix))
+
+    def delete(self, keys):
+        with memory_lock:
+            for key in keys:
+                self.objects.pop(key, None)
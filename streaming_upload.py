@@ -0,0 +1,218 @@
+import csv
+import io
+import json
+import os
+from itertools import islice
+from boto3.s3.transfer import TransferConfig
+from parquet_writer import iter_parquet_chunks
+from compression import normalize, iter_compressed
+from clustering import ColumnStats, stats_key
+
+# Tamaño de parte y concurrencia de la subida multiparte
+part_size = int(os.environ.get("UPLOAD_PART_SIZE_MB", "8")) * 1024 * 1024
+max_concurrency = int(os.environ.get("UPLOAD_MAX_CONCURRENCY", "4"))
+
+# Filas que se serializan de una vez antes de entregarlas al flujo
+chunk_rows = 500
+
+def create_transfer_config(part_size=part_size, max_concurrency=max_concurrency):
+    """Crea la configuración de s3transfer para subidas multiparte.
+
+    Limita las partes en memoria a la concurrencia, de modo que el consumo
+    máximo es de unas pocas partes sin importar el tamaño del lote.
+    """
+    config = TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=part_size,
+        max_concurrency=max_concurrency,
+    )
+    config.max_in_memory_upload_chunks = max_concurrency
+    return config
+
+transfer_config = create_transfer_config()
+
+def iter_chunks(records, size=chunk_rows):
+    """Agrupa un iterable de registros en listas de hasta `size` elementos."""
+    iterator = iter(records)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def iter_json(records):
+    """Serializa un arreglo JSON con el mismo formato que json.dumps(..., indent=4)."""
+    first = True
+    for chunk in iter_chunks(records):
+        parts = []
+        for record in chunk:
+            parts.append("[\n    " if first else ",\n    ")
+            parts.append(json.dumps(record, indent=4).replace("\n", "\n    "))
+            first = False
+        yield "".join(parts).encode("utf-8")
+    yield b"[]" if first else b"\n]"
+
+def iter_ndjson(records):
+    """Serializa los registros como NDJSON (un objeto JSON por línea)."""
+    first = True
+    for chunk in iter_chunks(records):
+        lines = "\n".join(json.dumps(record) for record in chunk)
+        yield (lines if first else "\n" + lines).encode("utf-8")
+        first = False
+
+def iter_csv(records, fieldnames=None, header=True):
+    """Serializa los registros como CSV; sin `fieldnames` usa las claves del primero.
+
+    Con header=False se omite el encabezado (filas para agregar a un CSV
+    existente). El encabezado se entrega como un bloque aparte.
+    """
+    output = io.StringIO()
+    writer = None
+    for chunk in iter_chunks(records):
+        if writer is None:
+            writer = csv.DictWriter(output, fieldnames=fieldnames or list(chunk[0].keys()))
+            if header:
+                writer.writeheader()
+                yield output.getvalue().encode("utf-8")
+                output.seek(0)
+                output.truncate()
+        writer.writerows(chunk)
+        yield output.getvalue().encode("utf-8")
+        output.seek(0)
+        output.truncate()
+    if writer is None and fieldnames and header:
+        csv.DictWriter(output, fieldnames=fieldnames).writeheader()
+        yield output.getvalue().encode("utf-8")
+
+def iter_serialized(records, format_type, schema=None, fieldnames=None, compression=None, footer=None, header=True):
+    """Retorna un generador de bloques de bytes con los registros serializados.
+
+    Los formatos de texto se comprimen en streaming con `compression`; en
+    Parquet el códec se aplica a las páginas internas del archivo y `footer`
+    agrega metadatos al pie. `header` solo aplica a CSV.
+    """
+    compression = normalize(compression)
+    if format_type == "parquet":
+        return iter_parquet_chunks(records, schema, compression=compression or "snappy", footer=footer)
+    elif format_type == "json":
+        chunks = iter_json(records)
+    elif format_type == "ndjson":
+        chunks = iter_ndjson(records)
+    elif format_type == "csv":
+        chunks = iter_csv(records, fieldnames, header)
+    else:
+        raise ValueError(f"Formato no soportado: {format_type}")
+    return iter_compressed(chunks, compression) if compression else chunks
+
+def content_encoding_args(format_type, compression, extra_args=None):
+    """Agrega ContentEncoding a los argumentos de subida de los formatos de texto comprimidos."""
+    extra_args = dict(extra_args or {})
+    compression = normalize(compression)
+    if compression and format_type != "parquet":
+        extra_args["ContentEncoding"] = compression
+    return extra_args
+
+class RowCounter:
+    """Envuelve un iterable de registros y cuenta los que se consumen."""
+
+    def __init__(self, records):
+        self._records = records
+        self.rows = 0
+
+    def __iter__(self):
+        for record in self._records:
+            self.rows += 1
+            yield record
+
+def stats_footer(counter):
+    """Metadatos del pie de Parquet con las estadísticas de las columnas de clustering.
+
+    Las de cada grupo de filas ya las escribe Parquet; aquí van las del archivo.
+    """
+    return lambda: {"clustering_stats": json.dumps(counter.stats, default=str)}
+
+def record_counter(records, format_type, stats_columns=None):
+    """Envuelve los registros para contar filas y, con `stats_columns`, calcular sus estadísticas."""
+    if stats_columns:
+        counter = ColumnStats(records, stats_columns)
+        footer = stats_footer(counter) if format_type == "parquet" else None
+        return counter, footer
+    return RowCounter(records), None
+
+class SerializedRecords:
+    """Registros serializados por adelantado, listos para subir sin volver a procesarlos."""
+
+    def __init__(self, records, format_type, schema=None, fieldnames=None, compression=None, stats_columns=None):
+        self.format_type = format_type
+        self.compression = compression
+        counter, footer = record_counter(records, format_type, stats_columns)
+        self.chunks = list(iter_serialized(counter, format_type, schema, fieldnames, compression, footer))
+        self.rows = counter.rows
+        self.counter = counter
+
+class RecordStream(io.RawIOBase):
+    """Flujo de solo lectura que serializa los registros a medida que se consume."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b"")
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        """Carga el siguiente bloque no vacío; retorna False al terminar."""
+        while not self._buffer:
+            try:
+                self._buffer = memoryview(next(self._chunks))
+            except StopIteration:
+                return False
+        return True
+
+    def readinto(self, b):
+        if not self._fill():
+            return 0
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        self.bytes_read += size
+        return size
+
+    def read(self, size=-1):
+        # s3transfer espera partes completas: solo se retorna menos al final del flujo
+        output = bytearray()
+        while (size is None or size < 0 or len(output) < size) and self._fill():
+            take = len(self._buffer) if size is None or size < 0 else size - len(output)
+            output += self._buffer[:take]
+            self._buffer = self._buffer[take:]
+        self.bytes_read += len(output)
+        return bytes(output)
+
+def upload_records(storage, key, records, format_type, schema=None, fieldnames=None,
+                   extra_args=None, config=None, compression=None, stats_columns=None):
+    """Serializa y sube los registros en streaming (en S3, con la subida multiparte de s3transfer).
+
+    `storage` es un backend de storage.py y `records` también puede ser un
+    SerializedRecords ya preparado. Retorna el tamaño subido en bytes y la
+    cantidad de filas.
+
+    Con `stats_columns` también retorna el min/max de esas columnas. En
+    Parquet van al pie del archivo; en los formatos de texto se escriben,
+    junto con las de cada bloque de filas, en el objeto auxiliar _stats/<key>.json.
+    """
+    if isinstance(records, SerializedRecords):
+        compression = records.compression
+        counter = records.counter
+        chunks = records.chunks
+    else:
+        counter, footer = record_counter(records, format_type, stats_columns)
+        chunks = iter_serialized(counter, format_type, schema, fieldnames, compression, footer)
+    extra_args = content_encoding_args(format_type, compression, extra_args)
+    size = storage.put_chunks(key, chunks, extra_args, config)
+    result = {"size": size, "rows": counter.rows}
+    if isinstance(counter, ColumnStats):
+        result["stats"] = counter.stats
+        if format_type != "parquet":
+            storage.put(stats_key(key), json.dumps(counter.sidecar(), default=str))
+    return result